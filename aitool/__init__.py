@@ -9,7 +9,8 @@ from aitool.basic_function.singleton import singleton
 from aitool.basic_function.pip_tool import pip_install_by_os, pip_install_by_main, pip_install
 
 from aitool.basic_function.basic import split_dict, replace_char, split_char, split_punctuation, is_appear
-from aitool.basic_function.deduplication import Deduplication, deduplicate
+from aitool.basic_function.deduplication import Deduplication, deduplicate, FingerprintSet, DigestSet, BloomFilter, \
+    CuckooFilter, get_deduplication, NearDuplication
 from aitool.basic_function.string_trans import find_all_position, get_ngram, get_ngrams, token_hit, filter_keyword
 from aitool.basic_function.distribution import normalize, cross_entropy, scale_array
 from aitool.basic_function.security import encrypt_md5
@@ -30,10 +31,12 @@ from aitool.basic_function.retry import retry
 from aitool.basic_function.time import timeout, timestamp, get_lastday_timestamp
 
 # cache 管理工具
-from aitool.basic_function.cache import cache, get_cache, Cache
+from aitool.basic_function.cache import cache, get_cache, Cache, make_key, make_typed_key, DiskCache, get_size, \
+    get_cache_infos, print_cache_infos, clear_caches, TieredCache
 
 # 多进程
-from aitool.basic_function.multi import pool_map, pool_starmap, multi_map, get_functions, multi
+from aitool.basic_function.multi import pool_map, pool_starmap, multi_map, get_functions, multi, PoolExecutor, \
+    get_executor, amulti_map, share, SharedObject, TaskTimeout, CancelToken, schedule, TaskError
 
 # ARITHMETIC FUNCTION
 from aitool.data_structure.arithmetic.dfs_search import Node, dfs, ranked_permutation
@@ -54,4 +57,5 @@ from aitool.knowledge_graph.paris.examples.core_example import alignment
 # task_customized
 from aitool.task_customized.ip_enhance.filter import has_family_name, is_common_word, is_stop_word, \
     is_relationship_title, delete_age_describe, is_black_name, clean_role, clean_alias, delete_nested_text, \
-    select_nested_text, is_sub_ip, get_core_ip
+    select_nested_text, is_sub_ip, get_core_ip, clean_roles, clean_aliases, RoleClassifier, build_word_snapshot, \
+    load_word_snapshot
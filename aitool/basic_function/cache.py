@@ -15,7 +15,312 @@
 """
 
 """
-from typing import Dict, Union, List, Any, NoReturn
+from typing import Dict, Union, List, Any, NoReturn, Hashable, Iterator, Tuple
+from collections import OrderedDict, Counter
+from functools import wraps
+from hashlib import blake2b
+from time import monotonic, perf_counter, time
+import asyncio
+import copy
+import inspect
+import os
+import pickle
+import sqlite3
+import dill
+import sys
+from types import ModuleType
+import threading
+import uuid
+import weakref
+
+from aitool.basic_function.retry import is_empty
+
+
+class _Missing:
+    """
+    未命中时的默认值。被修饰的函数可能被dill按值pickle到子进程，pickle后需要仍是同一个对象
+    """
+    def __reduce__(self):
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+# 所有被@cache修饰的函数，函数被回收后自动移除
+_REGISTRY = weakref.WeakSet()
+# DiskCache的表结构。cache_count表由触发器维护每个namespace的样例数，避免每次写入都count(*)。
+# 建表后把user_version设为_DISK_SCHEMA_VERSION，之后打开同一个文件时不再执行，避免每次连接都要获取写锁
+_DISK_SCHEMA_VERSION = 1
+_DISK_SCHEMA = '''
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS cache (
+    key BLOB PRIMARY KEY,
+    namespace TEXT,
+    value BLOB,
+    size INTEGER,
+    access REAL,
+    expire REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_namespace_access ON cache (namespace, access);
+CREATE INDEX IF NOT EXISTS cache_namespace_expire ON cache (namespace, expire);
+CREATE TABLE IF NOT EXISTS cache_count (namespace TEXT PRIMARY KEY, count INTEGER);
+CREATE TRIGGER IF NOT EXISTS cache_count_insert AFTER INSERT ON cache BEGIN
+    INSERT OR IGNORE INTO cache_count VALUES (NEW.namespace, 0);
+    UPDATE cache_count SET count = count + 1 WHERE namespace = NEW.namespace;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_count_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_count SET count = count - 1 WHERE namespace = OLD.namespace;
+END;
+PRAGMA user_version = {};
+COMMIT;
+'''.format(_DISK_SCHEMA_VERSION)
+
+
+class _LRUPolicy:
+    """
+    最近最少使用。用OrderedDict记录访问顺序，读写均为O(1)
+    """
+    def __init__(self, cache_size: int):
+        self.order = OrderedDict()
+
+    def on_get(self, key: Hashable) -> NoReturn:
+        self.order.move_to_end(key)
+
+    def on_set(self, key: Hashable) -> NoReturn:
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def on_delete(self, key: Hashable) -> NoReturn:
+        self.order.pop(key, None)
+
+    def expired(self, key: Hashable) -> bool:
+        return False
+
+    def evict(self) -> Hashable:
+        return self.order.popitem(last=False)[0]
+
+    def clear(self) -> NoReturn:
+        self.order.clear()
+
+
+class _TTLPolicy(_LRUPolicy):
+    """
+    写入ttl秒后过期，过期的条目在被读取时删除。容量满时淘汰最早写入的条目
+    """
+    def __init__(self, cache_size: int, ttl: float = None):
+        super().__init__(cache_size)
+        if ttl is None or ttl <= 0:
+            raise ValueError('ttl should bigger than 0 when method is \'ttl\'')
+        self.ttl = ttl
+
+    def on_get(self, key: Hashable) -> NoReturn:
+        pass
+
+    def on_set(self, key: Hashable) -> NoReturn:
+        self.order[key] = monotonic() + self.ttl
+        self.order.move_to_end(key)
+
+    def expired(self, key: Hashable) -> bool:
+        return self.order[key] <= monotonic()
+
+
+class _LFUPolicy:
+    """
+    最不经常使用。按访问次数分桶，同一访问次数内按最近最少使用淘汰，读写均为O(1)
+    """
+    def __init__(self, cache_size: int):
+        self.frequency = dict()
+        self.buckets = dict()
+        self.min_frequency = 0
+
+    def _move(self, key: Hashable, frequency: int) -> NoReturn:
+        bucket = self.buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[frequency]
+            if self.min_frequency == frequency:
+                self.min_frequency = frequency + 1
+        self.frequency[key] = frequency + 1
+        self.buckets.setdefault(frequency + 1, OrderedDict())[key] = None
+
+    def on_get(self, key: Hashable) -> NoReturn:
+        self._move(key, self.frequency[key])
+
+    def on_set(self, key: Hashable) -> NoReturn:
+        if key in self.frequency:
+            self._move(key, self.frequency[key])
+            return
+        self.frequency[key] = 1
+        self.buckets.setdefault(1, OrderedDict())[key] = None
+        self.min_frequency = 1
+
+    def on_delete(self, key: Hashable) -> NoReturn:
+        frequency = self.frequency.pop(key, None)
+        if frequency is None:
+            return
+        bucket = self.buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[frequency]
+            if self.min_frequency == frequency:
+                self.min_frequency = min(self.buckets) if self.buckets else 0
+
+    def expired(self, key: Hashable) -> bool:
+        return False
+
+    def evict(self) -> Hashable:
+        key = next(iter(self.buckets[self.min_frequency]))
+        self.on_delete(key)
+        return key
+
+    def clear(self) -> NoReturn:
+        self.frequency.clear()
+        self.buckets.clear()
+        self.min_frequency = 0
+
+
+class _FrequencySketch:
+    """
+    Count-Min Sketch，用于估计key的近期访问次数。每个计数上限为15，
+    总计数达到sample_size后全部减半，使旧的访问记录逐渐失效
+    """
+    _SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+    def __init__(self, cache_size: int):
+        width = 16
+        while width < cache_size:
+            width <<= 1
+        self.mask = width - 1
+        self.table = [[0] * width for _ in self._SEEDS]
+        self.sample_size = 10 * max(cache_size, 1)
+        self.additions = 0
+
+    def _indexes(self, key: Hashable) -> Iterator[int]:
+        h = hash(key)
+        for seed in self._SEEDS:
+            yield ((h * seed) >> 16) & self.mask
+
+    def increment(self, key: Hashable) -> NoReturn:
+        for row, index in zip(self.table, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for row in self.table:
+                for index in range(len(row)):
+                    row[index] >>= 1
+            self.additions //= 2
+
+    def frequency(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self.table, self._indexes(key)))
+
+
+class _TinyLFUPolicy:
+    """
+    W-TinyLFU。新条目先进入容量为1%的LRU窗口，被挤出窗口时和主区的淘汰候选比较近期访问次数，
+    次数更高的留下。主区是分段LRU：只访问过一次的在probation段，再次访问后升入protected段(占主区的80%)。
+    可以同时抵御一次性的扫描访问和访问热度的漂移
+    """
+    def __init__(self, cache_size: int):
+        self.window_size = max(1, cache_size // 100)
+        self.main_size = max(0, cache_size - self.window_size)
+        self.protected_size = int(self.main_size * 0.8)
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.sketch = _FrequencySketch(cache_size)
+
+    def on_get(self, key: Hashable) -> NoReturn:
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                self.probation[self.protected.popitem(last=False)[0]] = None
+        else:
+            self.protected.move_to_end(key)
+
+    def on_set(self, key: Hashable) -> NoReturn:
+        if key in self.window or key in self.probation or key in self.protected:
+            self.on_get(key)
+            return
+        self.sketch.increment(key)
+        self.window[key] = None
+
+    def on_delete(self, key: Hashable) -> NoReturn:
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                del segment[key]
+                return
+
+    def expired(self, key: Hashable) -> bool:
+        return False
+
+    def evict(self) -> Hashable:
+        if not self.main_size and self.window:
+            # cache_size为1时没有主区，退化为只有窗口的LRU
+            return self.window.popitem(last=False)[0]
+        while len(self.window) > self.window_size:
+            candidate = self.window.popitem(last=False)[0]
+            if len(self.probation) + len(self.protected) < self.main_size:
+                self.probation[candidate] = None
+                continue
+            victims = self.probation if self.probation else self.protected
+            victim = next(iter(victims))
+            if self.sketch.frequency(candidate) > self.sketch.frequency(victim):
+                del victims[victim]
+                self.probation[candidate] = None
+                return victim
+            return candidate
+        for segment in (self.probation, self.protected, self.window):
+            if segment:
+                return segment.popitem(last=False)[0]
+        raise KeyError('evict from an empty cache')
+
+    def clear(self) -> NoReturn:
+        self.window.clear()
+        self.probation.clear()
+        self.protected.clear()
+
+
+_POLICIES = {
+    'lru': _LRUPolicy,
+    'lfu': _LFUPolicy,
+    'ttl': _TTLPolicy,
+    'tinylfu': _TinyLFUPolicy,
+}
+
+
+def get_size(value: Any) -> int:
+    """
+    估计value占用的内存（字节）。递归累加容器及其元素、对象的__dict__的sys.getsizeof，
+    numpy数组等带nbytes的对象按其数据的大小计算，被多次引用的对象只计算一次
+    >>> get_size([b'a' * 100, b'a' * 100]) > 200
+    True
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if hasattr(item, 'nbytes') and hasattr(item, 'dtype'):
+            size += max(sys.getsizeof(item), item.nbytes)
+            continue
+        size += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, bytearray, int, float, bool)):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__') and not isinstance(item, (type, ModuleType)):
+            stack.append(item.__dict__)
+    return size
 
 
 class Cache(dict):
@@ -27,50 +332,748 @@ class Cache(dict):
     >>> c[3] = 3
     >>> c
     {0: 0, 1: 1}
+
+    lru模式下淘汰最久没有被读取的样例
+    >>> c = Cache(cache_size=2, method='lru')
+    >>> c[1] = 1
+    >>> c[2] = 2
+    >>> c[1]
+    1
+    >>> c[3] = 3
+    >>> c
+    {1: 1, 3: 3}
+    >>> c.stats()['hits'], c.stats()['evictions']
+    (1, 1)
+
+    lfu模式下淘汰读取次数最少的样例
+    >>> c = Cache(cache_size=2, method='lfu')
+    >>> c[1] = 1
+    >>> c[2] = 2
+    >>> c[2], c[2], c[1]
+    (2, 2, 1)
+    >>> c[3] = 3
+    >>> c
+    {2: 2, 3: 3}
+
+    设置max_bytes后按估计的内存占用淘汰
+    >>> c = Cache(cache_size=100, method='lru', max_bytes=2500)
+    >>> for i in range(3):
+    ...     c[i] = 'x' * 1000
+    >>> list(c), c.stats()['bytes'] <= 2500
+    ([1, 2], True)
+
+    tinylfu模式下cache_size为1时只保留最近写入的样例
+    >>> c = Cache(cache_size=1, method='tinylfu')
+    >>> c[1] = 1
+    >>> c[2] = 2
+    >>> c
+    {2: 2}
     """
-    def __init__(self, seq=None, cache_size=100000, method='block', **kwargs):
+    def __init__(self, seq=None, cache_size=100000, method='block', ttl=None, max_bytes=None, **kwargs):
         """
         :param seq: dict的默认参数
         :param cache_size: cache存储的数量上限
-        :param method: cache的控制模式。'block'表示只记录不更新
+        :param method: cache的控制模式。
+            'block'表示只记录不更新；
+            'lru'表示淘汰最久没有被读取的；
+            'lfu'表示淘汰读取次数最少的；
+            'ttl'表示写入ttl秒后过期，容量满时淘汰最早写入的；
+            'tinylfu'表示W-TinyLFU，依据近期访问次数决定是否接纳新样例，适用于访问热度会漂移的长期服务
+        :param ttl: method='ttl'时的过期时长（秒）
+        :param max_bytes: key和value估计的内存占用（字节）之和的上限，详见get_size。
+            超过时按method淘汰，block模式下不再记录。单个样例超过上限时不记录。None表示不限制
         :param kwargs: dict的默认参数
         """
-        if seq and kwargs:
-            super(Cache, self).__init__(seq, **kwargs)
-        elif not seq and kwargs:
-            super(Cache, self).__init__(**kwargs)
-        elif seq and not kwargs:
-            super(Cache, self).__init__(seq)
-        else:
-            super(Cache, self).__init__()
+        if method != 'block' and method not in _POLICIES:
+            raise ValueError('method should be one of block, {}'.format(', '.join(_POLICIES)))
+        if cache_size < 1:
+            raise ValueError('cache_size should bigger than 0')
         self.cache_size = cache_size
         self.method = method
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # 设置max_bytes时记录各个样例估计的内存占用
+        self.bytes = 0
+        self._sizes = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 淘汰机制的状态不是线程安全的，读写都需要加锁
+        self._lock = threading.RLock()
+        if method == 'block':
+            self._policy = None
+        elif method == 'ttl':
+            self._policy = _TTLPolicy(cache_size, ttl)
+        else:
+            self._policy = _POLICIES[method](cache_size)
+        if self._policy is None and max_bytes is None:
+            if seq and kwargs:
+                super(Cache, self).__init__(seq, **kwargs)
+            elif not seq and kwargs:
+                super(Cache, self).__init__(**kwargs)
+            elif seq and not kwargs:
+                super(Cache, self).__init__(seq)
+            else:
+                super(Cache, self).__init__()
+        else:
+            super(Cache, self).__init__()
+            self.update(seq or {}, **kwargs)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            size = 0
+            if self.max_bytes is not None:
+                size = get_size(key) + get_size(value)
+                if size > self.max_bytes:
+                    return
+            if self._policy is None:
+                if self.__len__() < self.cache_size and (
+                        self.max_bytes is None or self.bytes - self._sizes.get(key, 0) + size <= self.max_bytes):
+                    super().__setitem__(key, value)
+                    self._track(key, size)
+                return
+            exists = super().__contains__(key)
+            if exists and self.max_bytes is not None and self.bytes - self._sizes[key] + size > self.max_bytes:
+                # 先删除旧值，否则淘汰时可能选中正在写入的key
+                self.__delitem__(key)
+                exists = False
+            if not exists:
+                while self.__len__() >= self.cache_size or (
+                        self.max_bytes is not None and self.bytes + size > self.max_bytes):
+                    victim = self._policy.evict()
+                    super().__delitem__(victim)
+                    self.bytes -= self._sizes.pop(victim, 0)
+                    self.evictions += 1
+            self._policy.on_set(key)
+            super().__setitem__(key, value)
+            self._track(key, size)
+
+    def _track(self, key, size: int) -> NoReturn:
+        if self.max_bytes is not None:
+            self.bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        """
+        读取key对应的值，并记录命中或未命中
+        """
+        value = dict.get(self, key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        if self._policy is not None:
+            with self._lock:
+                if not super().__contains__(key):
+                    # 已被其他线程删除
+                    self.misses += 1
+                    return default
+                if self._policy.expired(key):
+                    self.__delitem__(key)
+                    self.evictions += 1
+                    self.misses += 1
+                    return default
+                self._policy.on_get(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key, stale: float = 0, default=None) -> Tuple[Any, bool]:
+        """
+        同get，但method='ttl'时过期不超过stale秒的值仍会返回
+        :return: (值, 是否已过期)
+        """
+        if self.method != 'ttl':
+            return self.get(key, default), False
+        with self._lock:
+            if not super().__contains__(key):
+                self.misses += 1
+                return default, False
+            overdue = monotonic() - self._policy.order[key]
+            if overdue > stale:
+                self.__delitem__(key)
+                self.evictions += 1
+                self.misses += 1
+                return default, False
+            self.hits += 1
+            return super().__getitem__(key), overdue >= 0
+
+    def __contains__(self, key):
+        if not super().__contains__(key):
+            return False
+        if self.method == 'ttl':
+            with self._lock:
+                if not super().__contains__(key):
+                    return False
+                if self._policy.expired(key):
+                    self.__delitem__(key)
+                    self.evictions += 1
+                    return False
+        return True
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+            if self._sizes:
+                self.bytes -= self._sizes.pop(key, 0)
+            if self._policy is not None:
+                self._policy.on_delete(key)
 
-    def __setitem__(self, *args, **kwargs):
-        if self.method == 'block':
-            if self.__len__() < self.cache_size:
-                super().__setitem__(*args, **kwargs)
+    def pop(self, key, default=_MISSING):
+        with self._lock:
+            if super().__contains__(key):
+                value = super().__getitem__(key)
+                self.__delitem__(key)
+                return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def update(self, seq=None, **kwargs):
+        for key, value in dict(seq or {}, **kwargs).items():
+            self[key] = value
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            super().clear()
+            self._sizes.clear()
+            self.bytes = 0
+            if self._policy is not None:
+                self._policy.clear()
+
+    def __reduce__(self):
+        # 淘汰机制的内部状态不随pickle传递，在新进程里重新建立
+        return self.__class__, (dict(self), self.cache_size, self.method, self.ttl, self.max_bytes)
+
+    def reset_stats(self) -> NoReturn:
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        命中、未命中、淘汰的次数和当前的样例数。bytes为估计的内存占用，仅在设置max_bytes时统计，否则为None
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': self.__len__(),
+            'cache_size': self.cache_size,
+            'bytes': self.bytes if self.max_bytes is not None else None,
+            'max_bytes': self.max_bytes,
+            'method': self.method,
+        }
 
 
 def get_cache(
         cache_size=100000,
+        method='block',
+        ttl=None,
+        max_bytes=None,
 ) -> dict:
-    return Cache(cache_size=cache_size)
+    return Cache(cache_size=cache_size, method=method, ttl=ttl, max_bytes=max_bytes)
 
 
 def _concat_all(*args, **kwargs) -> str:
     return '{}{}'.format(args, kwargs)
 
 
+class _KwargsMark:
+    """
+    key中分隔位置参数和关键字参数的标记，pickle后仍是同一个对象，保证key的序列化结果稳定
+    """
+    def __reduce__(self):
+        return '_KWARGS_MARK'
+
+
+_KWARGS_MARK = _KwargsMark()
+_FAST_TYPES = {int, str}
+
+
+def _digest(data: bytes) -> bytes:
+    return blake2b(data, digest_size=16).digest()
+
+
+def _freeze(value: Any) -> Hashable:
+    """
+    将不可hash的参数转为稳定的内容摘要。numpy数组按dtype、shape和内存中的数据计算，
+    list、dict等容器按pickle的结果计算，无法pickle的按repr计算
+    """
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        pass
+    if hasattr(value, 'tobytes') and hasattr(value, 'dtype') and hasattr(value, 'shape'):
+        return 'ndarray', str(value.dtype), value.shape, _digest(value.tobytes())
+    try:
+        data = pickle.dumps(value, protocol=4)
+    except Exception:
+        data = repr(value).encode('utf8')
+    return type(value).__name__, _digest(data)
+
+
+def _make_key(args: tuple, kwargs: dict, typed: bool) -> Hashable:
+    key = args
+    if kwargs:
+        key += (_KWARGS_MARK,)
+        for item in kwargs.items():
+            key += item
+    if typed:
+        key += tuple(type(value) for value in args)
+        if kwargs:
+            key += tuple(type(value) for value in kwargs.values())
+    elif len(key) == 1 and type(key[0]) in _FAST_TYPES:
+        return key[0]
+    try:
+        hash(key)
+    except TypeError:
+        key = tuple(_freeze(value) for value in key)
+    return key
+
+
+def make_key(*args, **kwargs) -> Hashable:
+    """
+    用函数的输入构建key：由可hash的参数组成的tuple，不可hash的参数（list、dict、numpy数组等）替换为其内容摘要。
+    只有一个int或str参数时直接用该参数作为key。不区分类型，即f(1)和f(1.0)的key相同
+    >>> make_key(1)
+    1
+    >>> make_key(1, y=2) == make_key(1, y=2)
+    True
+    >>> make_key([1, 2]) == make_key([1, 2]), make_key([1, 2]) == make_key([2, 1])
+    (True, False)
+    """
+    return _make_key(args, kwargs, False)
+
+
+def make_typed_key(*args, **kwargs) -> Hashable:
+    """
+    同make_key，但区分参数的类型，即f(1)和f(1.0)的key不同
+    >>> make_typed_key(1) == make_typed_key(1.0)
+    False
+    """
+    return _make_key(args, kwargs, True)
+
+
+class DiskCache:
+    """
+    基于sqlite的持久化cache，重启后仍然有效，多个进程（例如pool_map的各个子进程）可以同时读写同一个文件。
+    key和value用pickle序列化，key只保存其摘要。cache_size和len都按namespace计算，
+    超过cache_size时先淘汰本namespace已过期的样例，再淘汰最久没有被读取的样例，不影响同一个文件里的其他namespace
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    >>> c = DiskCache(path, cache_size=2)
+    >>> c[1] = 'a'
+    >>> c[2] = 'b'
+    >>> c[1]
+    'a'
+    >>> c[3] = 'c'
+    >>> 2 in c, len(c)
+    (False, 2)
+    >>> DiskCache(path).get(3)
+    'c'
+    >>> DiskCache(path, namespace='other').get(3) is None
+    True
+    """
+    def __init__(self, path: str, cache_size: int = None, ttl: float = None, namespace: str = ''):
+        """
+        :param path: sqlite文件的路径，不存在时自动创建
+        :param cache_size: 存储的数量上限，None表示不限制
+        :param ttl: 写入ttl秒后过期，None表示不过期
+        :param namespace: 区分同一个文件里的不同cache，@cache中为被修饰函数的名字
+        """
+        if cache_size is not None and cache_size < 1:
+            raise ValueError('cache_size should bigger than 0')
+        self.path = path
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # 子进程里重新连接数据库
+        return self.__class__, (self.path, self.cache_size, self.ttl, self.namespace)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # fork出的子进程不能沿用父进程的连接
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            # 多个进程同时建表时，后拿到写锁的进程重复执行也无妨
+            if connection.execute('PRAGMA user_version').fetchone()[0] < _DISK_SCHEMA_VERSION:
+                connection.executescript(_DISK_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _key(self, key: Hashable) -> bytes:
+        return _digest(pickle.dumps((self.namespace, key), protocol=4))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        读取key对应的值，并记录命中或未命中
+        """
+        digest = self._key(key)
+        now = time()
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT value, expire FROM cache WHERE key = ?', (digest,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                self.connection.execute('DELETE FROM cache WHERE key = ?', (digest,))
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            if self.cache_size is not None:
+                self.connection.execute('UPDATE cache SET access = ? WHERE key = ?', (now, digest))
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def get_stale(self, key: Hashable, stale: float = 0, default: Any = None) -> Tuple[Any, bool]:
+        """
+        同get，但过期不超过stale秒的值仍会返回
+        :return: (值, 是否已过期)
+        """
+        digest = self._key(key)
+        now = time()
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT value, expire FROM cache WHERE key = ?', (digest,)).fetchone()
+            if row is not None and row[1] is not None and now - row[1] > stale:
+                self.connection.execute('DELETE FROM cache WHERE key = ?', (digest,))
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return default, False
+            if self.cache_size is not None:
+                self.connection.execute('UPDATE cache SET access = ? WHERE key = ?', (now, digest))
+            self.hits += 1
+        return pickle.loads(row[0]), row[1] is not None and row[1] <= now
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> NoReturn:
+        digest = self._key(key)
+        data = pickle.dumps(value, protocol=4)
+        now = time()
+        expire = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT INTO cache (key, namespace, value, size, access, expire) VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+                    'access = excluded.access, expire = excluded.expire',
+                    (digest, self.namespace, data, len(data), now, expire))
+                if self.cache_size is not None and self._count(connection) > self.cache_size:
+                    # 只淘汰本namespace的样例：先删已过期的，仍超出时按LRU删最久没有被读取的
+                    cursor = connection.execute(
+                        'DELETE FROM cache WHERE namespace = ? AND expire <= ?', (self.namespace, now))
+                    self.evictions += cursor.rowcount
+                    over = self._count(connection) - self.cache_size
+                    if over > 0:
+                        connection.execute(
+                            'DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE namespace = ? '
+                            'ORDER BY access LIMIT ?)',
+                            (self.namespace, over))
+                        self.evictions += over
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def __contains__(self, key: Hashable) -> bool:
+        row = self.connection.execute(
+            'SELECT expire FROM cache WHERE key = ?', (self._key(key),)).fetchone()
+        return row is not None and (row[0] is None or row[0] > time())
+
+    def __delitem__(self, key: Hashable) -> NoReturn:
+        with self._lock:
+            cursor = self.connection.execute('DELETE FROM cache WHERE key = ?', (self._key(key),))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def _count(self, connection: sqlite3.Connection) -> int:
+        row = connection.execute('SELECT count FROM cache_count WHERE namespace = ?', (self.namespace,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def __len__(self) -> int:
+        """
+        当前namespace的样例数
+        """
+        return self._count(self.connection)
+
+    def clear(self) -> NoReturn:
+        """
+        清空当前namespace的样例，同一个文件里其他namespace的样例不受影响
+        """
+        with self._lock:
+            self.connection.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+
+    def close(self) -> NoReturn:
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def reset_stats(self) -> NoReturn:
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        当前进程内的命中、未命中、淘汰的次数和本namespace的样例数
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': self.__len__(),
+            'cache_size': self.cache_size,
+            'method': 'disk',
+        }
+
+
+class TieredCache:
+    """
+    两级cache：进程内的小容量LRU（L1）加多个进程共享的L2。L1未命中时读L2，L2命中后写回L1；写入时同时写两级。
+    L2可以是DiskCache，也可以是multiprocess.Manager().dict()等各进程共享的dict。
+    适用于pool_map：各个子进程的L1互不相通，但通过L2复用其他子进程算出的结果
+    >>> c = TieredCache(dict(), l1_size=1)
+    >>> c[1] = 'a'
+    >>> c[2] = 'b'
+    >>> c[1], c.get(3)
+    ('a', None)
+    >>> c.stats()['l1_hits'], c.stats()['l2_hits'], c.stats()['misses']
+    (0, 1, 1)
+    """
+    def __init__(self, l2: Any, l1_size: int = 1024, ttl: float = None, namespace: str = '', token: str = None):
+        """
+        :param l2: 共享的L2，DiskCache或任何支持[]和[]=的dict
+        :param l1_size: 进程内L1的数量上限
+        :param ttl: 设置后L1按ttl过期；L2为DiskCache时以DiskCache自身的ttl为准，为dict时不过期
+        :param namespace: L2为dict时用于区分不同函数的key
+        :param token: 同一个TieredCache在各个进程里的标识，unpickle时复用本进程里已有的对象
+        """
+        self.l1 = Cache(cache_size=l1_size, method='ttl' if ttl is not None else 'lru', ttl=ttl)
+        self.l2 = l2
+        self.l1_size = l1_size
+        self.ttl = ttl
+        self.namespace = namespace
+        self.token = token if token is not None else uuid.uuid4().hex
+        self.l2_hits = 0
+        self.misses = 0
+        _TIERED_CACHES[self.token] = self
+
+    def __reduce__(self):
+        # L2先单独序列化，子进程里已有同一个TieredCache时不再反序列化
+        return _rebuild_tiered, (self.token, dill.dumps(self.l2), self.l1_size, self.ttl, self.namespace)
+
+    @property
+    def hits(self) -> int:
+        return self.l1.hits + self.l2_hits
+
+    def reset_stats(self) -> NoReturn:
+        self.l1.reset_stats()
+        self.l2_hits = 0
+        self.misses = 0
+
+    def _l2_key(self, key: Hashable) -> Hashable:
+        return key if isinstance(self.l2, DiskCache) else (self.namespace, key)
+
+    def _l2_get(self, key: Hashable) -> Any:
+        if isinstance(self.l2, DiskCache):
+            return self.l2.get(key, _MISSING)
+        # Manager的dict会把默认值传到另一个进程再传回，无法用_MISSING判断，只能捕获KeyError
+        try:
+            return self.l2[self._l2_key(key)]
+        except KeyError:
+            return _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = self._l2_get(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.l2_hits += 1
+        self.l1[key] = value
+        return value
+
+    def get_stale(self, key: Hashable, stale: float = 0, default: Any = None) -> Tuple[Any, bool]:
+        """
+        同get，但过期不超过stale秒的值仍会返回
+        :return: (值, 是否已过期)
+        """
+        value, expired = self.l1.get_stale(key, stale, _MISSING)
+        if value is not _MISSING:
+            return value, expired
+        if isinstance(self.l2, DiskCache):
+            value, expired = self.l2.get_stale(key, stale, _MISSING)
+        else:
+            value, expired = self._l2_get(key), False
+        if value is _MISSING:
+            self.misses += 1
+            return default, False
+        self.l2_hits += 1
+        if not expired:
+            self.l1[key] = value
+        return value, expired
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> NoReturn:
+        self.l2[self._l2_key(key)] = value
+        self.l1[key] = value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.l1 or self._l2_key(key) in self.l2
+
+    def __delitem__(self, key: Hashable) -> NoReturn:
+        self.l1.pop(key, None)
+        del self.l2[self._l2_key(key)]
+
+    def __len__(self) -> int:
+        return len(self.l2)
+
+    def clear(self) -> NoReturn:
+        """
+        清空当前进程的L1和L2。L2为dict时只清空当前namespace的样例，其他进程的L1不受影响
+        """
+        self.l1.clear()
+        if isinstance(self.l2, DiskCache):
+            self.l2.clear()
+        else:
+            for key in [key for key in self.l2.keys() if key[0] == self.namespace]:
+                self.l2.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        当前进程内L1和L2的命中次数、未命中次数，以及L1淘汰的次数和L2的样例数
+        """
+        return {
+            'hits': self.hits,
+            'l1_hits': self.l1.hits,
+            'l2_hits': self.l2_hits,
+            'misses': self.misses,
+            'evictions': self.l1.evictions,
+            'size': self.__len__(),
+            'cache_size': self.l1_size,
+            'method': 'tiered',
+        }
+
+
+# 各个TieredCache，key为其token。
+# pool_map的子进程每收到一块任务都会unpickle一次被修饰的函数，复用已有的对象使L1在整个子进程里有效；
+# 同时避免Manager的dict代理对象被反复创建和回收：每次创建都要和Manager新建连接，
+# 并且代理对象被回收时会关闭本进程和Manager的连接，如果恰好发生在其他代理对象通信的过程中会使其出错
+_TIERED_CACHES = dict()
+
+
+def _rebuild_tiered(token: str, l2: bytes, l1_size: int, ttl: float, namespace: str) -> TieredCache:
+    tiered = _TIERED_CACHES.get(token)
+    if tiered is None:
+        tiered = TieredCache(dill.loads(l2), l1_size=l1_size, ttl=ttl, namespace=namespace, token=token)
+    return tiered
+
+
+class _Error:
+    """
+    negative cache里记录的异常。保存不带traceback的副本，避免引用出错时的栈帧，
+    每次抛出前也清空traceback，否则同一个异常反复抛出时traceback会越来越长
+    """
+    def __init__(self, error: Exception):
+        try:
+            error = copy.copy(error)
+        except Exception:
+            pass
+        self.error = error.with_traceback(None)
+
+    def throw(self) -> NoReturn:
+        raise self.error.with_traceback(None)
+
+
+class _Flight:
+    """
+    记录一次正在进行的计算，其他线程等待其结果而不是重复计算
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self) -> Any:
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
 def cache(
         cache_size=100000,
-        get_key=_concat_all,
+        get_key=None,
+        method='block',
+        ttl=None,
+        typed=False,
+        backend='memory',
+        path=None,
+        l2=None,
+        l1_size=1024,
+        max_bytes=None,
+        hot_keys=0,
+        negative_ttl=None,
+        stale_while_revalidate=None,
 ):
     """
     用于修饰某个函数，将自动记录函数的输入输出。
-    仅记录前cache_size的输入输出结果，没有淘汰机制。
+    默认仅记录前cache_size的输入输出结果，没有淘汰机制。
+    被修饰的函数的cache属性即为所用的Cache；cache_info()返回命中率、平均计算耗时和节省的时间等统计值，
+    cache_clear()清空记录和统计值。所有被修饰的函数都可以通过get_cache_infos()一起查看。
+    线程安全：多个线程同时读取同一个未命中的key时只有一个线程真正执行函数，其他线程等待其结果，出错时一同抛出。
+    可以修饰async def的函数，缓存的是await后的结果，同一个事件循环里同时读取同一个key的协程共用一次计算。
     :param cache_size: 存储的输入输出对的数量
-    :param get_key: 用函数的输入构建key的方法，默认为concat_all
+    :param get_key: 用函数的输入构建key的方法，默认为make_key，typed=True时为make_typed_key。
+        旧版本的默认值_concat_all需要将参数格式化为字符串，开销较大
+    :param method: 淘汰机制，'block'、'lru'、'lfu'、'ttl'或'tinylfu'，详见Cache
+    :param ttl: method='ttl'时的过期时长（秒）
+    :param typed: 是否区分参数的类型，仅在未设置get_key时有效
+    :param backend: 'memory'表示存在进程内的Cache里；'disk'表示存在path指向的sqlite文件里（DiskCache），
+        重启后和pool_map的各个子进程之间都可以复用，此时method只支持最久未读取淘汰，cache_size=None表示不限制数量。
+        get_key的结果需要能被pickle
+        'tiered'表示两级cache（TieredCache）：进程内容量为l1_size的LRU加共享的L2，L2为path指向的DiskCache或l2，
+        适用于pool_map中各子进程复用彼此的结果
+    :param path: backend='disk'或'tiered'时sqlite文件的路径，多个函数可以共用一个文件
+    :param l2: backend='tiered'且未设置path时共享的L2，例如multiprocess.Manager().dict()
+    :param l1_size: backend='tiered'时进程内L1的数量上限
+    :param max_bytes: backend='memory'时输入输出对估计的内存占用之和的上限（字节），详见Cache
+    :param hot_keys: 大于0时统计各个key的命中次数，cache_info()里列出命中最多的hot_keys个key
+    :param negative_ttl: 设置后，抛出的异常和为空的返回值（例如@retry全部失败后返回的None）也会被记录，
+        但只保留negative_ttl秒，期间再次调用直接抛出同一个异常或返回该空值，不会反复执行慢的函数
+    :param stale_while_revalidate: 需要设置ttl。过期不超过stale_while_revalidate秒的结果仍被直接返回，
+        同时在后台（线程或当前事件循环里的任务）重新计算一次，调用者不用等待重新计算
     :return: Any
 
     在下例中第二次调用不会真正执行repeat函数
@@ -79,20 +1082,260 @@ def cache(
     10
     10
     """
+    if get_key is None:
+        get_key = make_typed_key if typed else make_key
+    if backend not in ('memory', 'disk', 'tiered'):
+        raise ValueError('backend should be \'memory\', \'disk\' or \'tiered\'')
+    if backend == 'disk' and path is None:
+        raise ValueError('path is required when backend is \'disk\'')
+    if backend == 'tiered' and path is None and l2 is None:
+        raise ValueError('path or l2 is required when backend is \'tiered\'')
+    if stale_while_revalidate is not None and ttl is None:
+        raise ValueError('ttl is required when stale_while_revalidate is set')
+    if stale_while_revalidate is not None and backend == 'memory' and method != 'ttl':
+        raise ValueError('method should be \'ttl\' when stale_while_revalidate is set')
+
     def decorate(func):
-        _cache = Cache(cache_size=cache_size)
+        namespace = '{}.{}'.format(func.__module__, func.__qualname__)
+        if backend == 'disk':
+            _cache = DiskCache(path, cache_size=cache_size, ttl=ttl, namespace=namespace)
+        elif backend == 'tiered':
+            shared = DiskCache(path, cache_size=cache_size, ttl=ttl, namespace=namespace) if path is not None else l2
+            _cache = TieredCache(shared, l1_size=l1_size, ttl=ttl, namespace=namespace)
+        else:
+            _cache = Cache(cache_size=cache_size, method=method, ttl=ttl, max_bytes=max_bytes)
+        # 出错和返回值为空的结果单独记录，negative_ttl秒后过期
+        negative = None
+        if negative_ttl is not None:
+            negative = Cache(cache_size=cache_size, method='ttl', ttl=negative_ttl)
+        # 真正执行func的次数和总耗时，用于估计cache节省的时间
+        record = {'computes': 0, 'compute_time': 0.0}
+        hot = Counter()
 
+        # 正在计算的key: key -> _Flight或asyncio.Future，同一个key同时只计算一次
+        inflight = dict()
+        # 正在后台刷新的key和刷新的协程任务
+        refreshing = set()
+        tasks = set()
+        lock = threading.Lock()
+
+        def _join(key):
+            # 返回(是否由当前调用者计算, _Flight)
+            with lock:
+                flight = inflight.get(key)
+                if flight is not None:
+                    return False, flight
+                flight = inflight[key] = _Flight()
+                return True, flight
+
+        def _leave(key, flight):
+            with lock:
+                inflight.pop(key, None)
+            flight.event.set()
+
+        def _lookup(key, args, kwargs, refresh):
+            if stale_while_revalidate is None:
+                result = _cache.get(key, _MISSING)
+            else:
+                result, expired = _cache.get_stale(key, stale_while_revalidate, _MISSING)
+                if expired:
+                    with lock:
+                        start = key not in refreshing
+                        refreshing.add(key)
+                    if start:
+                        refresh(key, args, kwargs)
+            if result is _MISSING and negative is not None:
+                result = negative.get(key, _MISSING)
+                if isinstance(result, _Error):
+                    result.throw()
+            if result is not _MISSING and hot_keys:
+                hot[key] += 1
+            return result
+
+        def _store(key, result, begin):
+            record['compute_time'] += perf_counter() - begin
+            record['computes'] += 1
+            if negative is not None and is_empty(result):
+                negative[key] = result
+            else:
+                _cache[key] = result
+
+        def _store_error(key, error):
+            if negative is not None and isinstance(error, Exception):
+                negative[key] = _Error(error)
+
+        def _compute(key, args, kwargs):
+            begin = perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                _store_error(key, e)
+                raise
+            _store(key, result, begin)
+            return result
+
+        def _refresh(key, args, kwargs):
+            # 在后台线程里重新计算，期间仍返回过期的结果
+            def _run():
+                try:
+                    _compute(key, args, kwargs)
+                except Exception as e:
+                    print('Warning: cache refresh failed', e)
+                finally:
+                    with lock:
+                        refreshing.discard(key)
+            threading.Thread(target=_run, daemon=True).start()
+
+        @wraps(func)
         def implement(*args, **kwargs):
             key = get_key(*args, **kwargs)
-            if key in _cache:
-                return _cache[key]
-            result = func(*args, **kwargs)
-            _cache[key] = result
+            result = _lookup(key, args, kwargs, _refresh)
+            if result is not _MISSING:
+                return result
+            leader, flight = _join(key)
+            if not leader:
+                return flight.wait()
+            try:
+                # 等待锁的过程中其他调用者可能已经算完
+                result = _cache.get(key, _MISSING) if key in _cache else _MISSING
+                if result is _MISSING:
+                    result = _compute(key, args, kwargs)
+                flight.result = result
+                return result
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                _leave(key, flight)
+
+        async def _acompute(key, args, kwargs):
+            begin = perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                _store_error(key, e)
+                raise
+            _store(key, result, begin)
             return result
-        return implement
+
+        def _arefresh(key, args, kwargs):
+            # 在当前事件循环里新建任务重新计算，期间仍返回过期的结果
+            async def _run():
+                try:
+                    await _acompute(key, args, kwargs)
+                except Exception as e:
+                    print('Warning: cache refresh failed', e)
+                finally:
+                    with lock:
+                        refreshing.discard(key)
+            # 保留任务的引用，避免运行中被回收
+            task = asyncio.get_running_loop().create_task(_run())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        @wraps(func)
+        async def async_implement(*args, **kwargs):
+            key = get_key(*args, **kwargs)
+            result = _lookup(key, args, kwargs, _arefresh)
+            if result is not _MISSING:
+                return result
+            loop = asyncio.get_running_loop()
+            with lock:
+                future = inflight.get(key)
+                leader = future is None or future.get_loop() is not loop
+                if leader:
+                    future = inflight[key] = loop.create_future()
+            if not leader:
+                # shield避免某个等待者被取消时影响其他等待者
+                return await asyncio.shield(future)
+            try:
+                result = await _acompute(key, args, kwargs)
+                future.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # 没有其他等待者时不打印“exception was never retrieved”
+                future.exception()
+                raise
+            finally:
+                with lock:
+                    if inflight.get(key) is future:
+                        inflight.pop(key)
+
+        def cache_info() -> Dict[str, Any]:
+            info = _cache.stats()
+            info['name'] = namespace
+            info['computes'] = record['computes']
+            info['compute_time'] = record['compute_time']
+            average = record['compute_time'] / record['computes'] if record['computes'] else 0.0
+            info['average_compute_time'] = average
+            if negative is not None:
+                # 命中negative cache的调用在主cache里被记为未命中，改记为命中
+                info['hits'] += negative.hits
+                info['misses'] -= negative.hits
+                info['negative_hits'] = negative.hits
+                info['negative_size'] = len(negative)
+            info['time_saved'] = average * info['hits']
+            if hot_keys:
+                info['hot_keys'] = hot.most_common(hot_keys)
+            return info
+
+        def cache_clear() -> NoReturn:
+            _cache.clear()
+            if negative is not None:
+                negative.clear()
+                negative.reset_stats()
+            _cache.reset_stats()
+            record['computes'] = 0
+            record['compute_time'] = 0.0
+            hot.clear()
+
+        wrapper = async_implement if inspect.iscoroutinefunction(func) else implement
+        wrapper.cache = _cache
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        _REGISTRY.add(wrapper)
+        return wrapper
     return decorate
 
 
+def get_cache_infos(sort_by: str = 'time_saved') -> List[Dict[str, Any]]:
+    """
+    所有被@cache修饰的函数的cache_info()，默认按节省的时间从大到小排列
+    :param sort_by: 排序依据的统计值
+    :return: 各个函数的cache_info()
+    """
+    infos = [wrapper.cache_info() for wrapper in list(_REGISTRY)]
+    infos.sort(key=lambda info: info.get(sort_by) or 0, reverse=True)
+    return infos
+
+
+def print_cache_infos(sort_by: str = 'time_saved') -> NoReturn:
+    """
+    打印所有被@cache修饰的函数的主要统计值，用于依据实际的命中率调整cache_size
+    """
+    print('{:<40}{:>10}{:>10}{:>8}{:>10}{:>12}{:>12}'.format(
+        'name', 'hits', 'misses', 'hit%', 'size', 'evictions', 'saved(s)'))
+    for info in get_cache_infos(sort_by):
+        total = info['hits'] + info['misses']
+        print('{:<40}{:>10}{:>10}{:>8.1f}{:>10}{:>12}{:>12.3f}'.format(
+            info['name'][-40:], info['hits'], info['misses'], 100 * info['hits'] / total if total else 0,
+            info['size'], info['evictions'], info['time_saved']))
+
+
+def clear_caches() -> NoReturn:
+    """
+    清空所有被@cache修饰的函数的记录和统计值
+    """
+    for wrapper in list(_REGISTRY):
+        wrapper.cache_clear()
+
+
 def _test_cache():
     @cache()
     def repeat(x):
@@ -103,6 +1346,67 @@ def _test_cache():
     print(repeat(10))
 
 
+def _test_cache_concurrent():
+    from concurrent.futures import ThreadPoolExecutor
+    from time import sleep
+
+    calls = []
+
+    @cache(method='lru')
+    def slow(x):
+        calls.append(x)
+        sleep(0.1)
+        return x
+
+    @cache(method='lru')
+    async def aslow(x):
+        calls.append(x)
+        await asyncio.sleep(0.1)
+        return x
+
+    async def _gather():
+        return await asyncio.gather(*[aslow(2) for _ in range(10)])
+
+    with ThreadPoolExecutor(10) as executor:
+        print(list(executor.map(slow, [1] * 10)))
+    print(asyncio.run(_gather()))
+    print(calls)
+
+
+def _time_per_call(function, arguments, repeat=3) -> float:
+    # arguments是(args, kwargs)的列表
+    best = None
+    for _ in range(repeat):
+        begin = perf_counter()
+        for args, kwargs in arguments:
+            function(*args, **kwargs)
+        cost = (perf_counter() - begin) / len(arguments)
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def benchmark_cache(number=100000):
+    """
+    对比@cache在命中时每次调用的额外耗时（微秒）
+    """
+    def toy(*args, **kwargs):
+        return args, kwargs
+
+    cases = {
+        'int': [((i % 100,), {}) for i in range(number)],
+        'str+kwarg': [(('a',), {'n': i % 100}) for i in range(number)],
+        'list(1000)': [((list(range(1000)),), {}) for _ in range(number // 100)],
+    }
+    print('{:<12}{:>10}{:>14}{:>12}'.format('args', 'bare', '_concat_all', 'make_key'))
+    for name, arguments in cases.items():
+        bare = _time_per_call(toy, arguments)
+        concat = _time_per_call(cache(get_key=_concat_all)(toy), arguments)
+        fast = _time_per_call(cache()(toy), arguments)
+        print('{:<12}{:>10.3f}{:>14.3f}{:>12.3f}'.format(name, bare * 1e6, concat * 1e6, fast * 1e6))
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
+    _test_cache_concurrent()
+    benchmark_cache()
@@ -15,8 +15,25 @@
 """
 
 """
-from aitool.basic_function.security import encrypt_md5
-from typing import Dict, List, Iterator, Any, NoReturn
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import sys
+from hashlib import blake2b
+from collections import defaultdict
+from typing import List, Iterator, Any, NoReturn, Union
+
+import numpy as np
+
+_WORD_MASK = (1 << 64) - 1
+_HASHER_64 = blake2b(digest_size=8)
+_HASHER_128 = blake2b(digest_size=16)
+_ZERO_64 = bytes(8)
+_ONE_64 = (1).to_bytes(8, 'little')
+_POPCOUNT = np.array([bin(number).count('1') for number in range(256)], dtype=np.uint8)
 
 
 def deduplicate(items: Iterator[Any]) -> List[Any]:
@@ -34,25 +51,950 @@ def deduplicate(items: Iterator[Any]) -> List[Any]:
     return item_ddp
 
 
+def _to_bytes(item: Any) -> bytes:
+    if not isinstance(item, str):
+        item = '{}'.format(item)
+    return item.encode('utf-8')
+
+
+def _digests(items: Iterator[Any], hasher) -> np.ndarray:
+    # 批量计算摘要，返回形状为(n, digest_size//8)的uint64数组，每行是摘要按小端序切成的64位整数。
+    # 摘要仍由hashlib逐个计算，批量只省去了探测和函数调用的开销。用numpy对拼接后的字节做多项式哈希实测比逐个blake2b更慢，
+    # 而且逐个调用时也要得到相同的指纹，所以没有采用
+    copy = hasher.copy
+    digests = bytearray()
+    for item in items:
+        if not isinstance(item, str):
+            item = '{}'.format(item)
+        new_hasher = copy()
+        new_hasher.update(item.encode('utf-8'))
+        digests += new_hasher.digest()
+    return np.frombuffer(bytes(digests), dtype='<u8').astype(np.uint64).reshape(-1, hasher.digest_size // 8)
+
+
+def _unique_keys(keys: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    # 批内去重，返回不重复的行、每行第一次出现的位置、原来每行对应的不重复行的序号
+    if keys.shape[1] == 1:
+        unique, first, inverse = np.unique(keys[:, 0], return_index=True, return_inverse=True)
+        return unique.reshape(-1, 1), first, inverse.reshape(-1)
+    unique, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return unique, first, inverse.reshape(-1)
+
+
+def _batch_result(found: np.ndarray, first: np.ndarray, inverse: np.ndarray, update: bool) -> np.ndarray:
+    # 把不重复的行的查询结果展开到原来的每一行。update时批内第二次及以后出现的也算重复
+    result = found[inverse]
+    if update:
+        result |= first[inverse] != np.arange(len(inverse))
+    return result
+
+
+def _next_prime(number: int) -> int:
+    # 返回不小于number的最小质数
+    number = max(number, 3) | 1
+    while any(number % divisor == 0 for divisor in range(3, int(number ** 0.5) + 1, 2)):
+        number += 2
+    return number
+
+
+class _ArrayStore:
+    """
+    把状态存在numpy数组table里的去重结构的公共部分：pickle、保存为可内存映射的文件、读取
+    子类在_bind里由table重建memoryview等不能pickle的属性，META列出需要保存的其他属性
+    """
+    META = ()
+    _UNPICKLABLE = ('_view', '_hasher', '_random')
+
+    def _bind(self) -> NoReturn:
+        raise NotImplementedError
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for name in self._UNPICKLABLE:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: dict) -> NoReturn:
+        self.__dict__.update(state)
+        self._bind()
+
+    def meta(self) -> dict:
+        return {name: getattr(self, name) for name in self.META}
+
+    @classmethod
+    def from_state(cls, meta: dict, table: np.ndarray):
+        """
+        由meta和table重建，table可以是np.memmap
+        """
+        store = cls.__new__(cls)
+        store.__setstate__(dict(meta, table=table))
+        return store
+
+    def _check_mergeable(self, other, *names: str) -> NoReturn:
+        # 只有类型相同且names列出的参数都相同时才能合并
+        if type(other) is not type(self) or any(getattr(other, name) != getattr(self, name) for name in names):
+            raise ValueError('can not merge {} into {} with different {}'.format(
+                type(other).__name__, type(self).__name__, names))
+
+
+class FingerprintSet(_ArrayStore):
+    """
+    定长二进制指纹的开放寻址哈希表。
+    每个元素只保存bits位的blake2b摘要作为指纹，存放在numpy数组里，冲突时用双重哈希探测。
+    bits=64时装载率保持在0.53~0.8之间，每个元素约占10~15字节（python的set加md5字符串约130字节）。
+    不同元素指纹相同的概率约为n^2/2^(bits+1)，bits=64时2亿个元素约有0.1%的概率出现一次误判，需要更低误判率时用bits=128。
+    逐个add时探测在python里进行，比encrypt_md5加set慢约60%；add_many批量探测，比encrypt_md5加set略快。
+    Deduplication(mode='compact')使用，适合内存紧张、能批量处理或需要save后内存映射读取的场景
+    """
+    LOAD_FACTOR = 0.8
+    GROWTH = 1.5
+    META = ('bits', 'words', 'size', 'slots', 'limit')
+
+    def __init__(self, capacity: int = 1024, bits: int = 64):
+        """
+        :param capacity: 预计的元素个数，预先分配足够的空间以避免扩容
+        :param bits: 指纹的位数，64或128
+        """
+        if bits not in (64, 128):
+            raise ValueError('bits should be 64 or 128')
+        self.bits = bits
+        self.words = bits // 64
+        self.size = 0
+        self._allocate(int(capacity / self.LOAD_FACTOR) + 1)
+
+    def _allocate(self, slots: int) -> NoReturn:
+        # 全0表示空位，指纹的第一个字不会为0。位置数取质数，保证双重哈希的探测序列能遍历所有位置
+        slots = _next_prime(slots)
+        table = getattr(self, 'table', None)
+        if isinstance(table, np.memmap) and table.mode == 'r+' and table.filename:
+            # 以'r+'映射的表扩容后仍写回同一个文件：先建临时文件再替换，原来的映射不受影响
+            temp = table.filename + '.tmp'
+            np.lib.format.open_memmap(temp, mode='w+', dtype=np.uint64, shape=(slots, self.words)).flush()
+            os.replace(temp, table.filename)
+            self.table = np.load(table.filename, mmap_mode='r+')
+        else:
+            self.table = np.zeros((slots, self.words), dtype=np.uint64)
+        self.slots = slots
+        self.limit = int(slots * self.LOAD_FACTOR)
+        self._bind()
+
+    def _bind(self) -> NoReturn:
+        # 复制预先设置好digest_size的哈希对象，比每次传参构造快
+        self._hasher = blake2b(digest_size=self.words * 8)
+        # 逐个操作时用memoryview读写，比numpy的标量下标快得多
+        self._view = memoryview(self.table.reshape(-1)).cast('B').cast('Q')
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def __len__(self) -> int:
+        return self.size
+
+    def fingerprint(self, item: Any) -> int:
+        """
+        计算item的指纹，返回一个bits位的非0整数
+        """
+        if not isinstance(item, str):
+            item = '{}'.format(item)
+        hasher = self._hasher.copy()
+        hasher.update(item.encode('utf-8'))
+        return int.from_bytes(hasher.digest(), 'little') or 1
+
+    def fingerprints(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量计算指纹，返回形状为(n, bits//64)的uint64数组
+        """
+        keys = _digests(items, self._hasher)
+        keys[keys[:, 0] == 0, 0] = 1
+        return keys
+
+    def _probe(self, key: int) -> (int, bool):
+        # 返回key所在的位置或第一个空位，以及key是否已存在。128位的指纹低64位存在第一个字，低64位为0时存1
+        view = self._view
+        slots = self.slots
+        words = self.words
+        first = key & _WORD_MASK or 1
+        second = key >> 64
+        slot = first % slots
+        step = (first >> 32) % (slots - 1) + 1
+        while True:
+            word = view[slot * words]
+            if word == first and (words == 1 or view[slot * 2 + 1] == second):
+                return slot, True
+            if word == 0:
+                return slot, False
+            slot += step
+            if slot >= slots:
+                slot -= slots
+
+    def contains_key(self, key: int) -> bool:
+        return self._probe(key)[1]
+
+    def add_key(self, key: int) -> bool:
+        """
+        加入指纹key
+        :return: 加入前key是否已存在
+        """
+        slot, found = self._probe(key)
+        if found:
+            return True
+        if self.words == 1:
+            self._view[slot] = key
+        else:
+            self._view[slot * 2] = key & _WORD_MASK or 1
+            self._view[slot * 2 + 1] = key >> 64
+        self.size += 1
+        if self.size > self.limit:
+            self._resize(int(self.slots * self.GROWTH))
+        return False
+
+    def __contains__(self, item: Any) -> bool:
+        return self._probe(self.fingerprint(item))[1]
+
+    def add(self, item: Any) -> bool:
+        """
+        加入item
+        :return: 加入前item是否已存在
+        >>> fingerprints = FingerprintSet()
+        >>> fingerprints.add('a'), fingerprints.add('a'), 'b' in fingerprints
+        (False, True, False)
+        """
+        if self.words != 1:
+            return self.add_key(self.fingerprint(item))
+        # 64位指纹是最常用的情况，展开fingerprint和_probe以减少函数调用，第一个位置冲突时才计算步长
+        if item.__class__ is not str:
+            item = '{}'.format(item)
+        hasher = self._hasher.copy()
+        hasher.update(item.encode('utf-8'))
+        key = int.from_bytes(hasher.digest(), 'little') or 1
+        view = self._view
+        slots = self.slots
+        slot = key % slots
+        word = view[slot]
+        if word == key:
+            return True
+        if word:
+            step = (key >> 32) % (slots - 1) + 1
+            while True:
+                slot += step
+                if slot >= slots:
+                    slot -= slots
+                word = view[slot]
+                if word == key:
+                    return True
+                if not word:
+                    break
+        view[slot] = key
+        self.size += 1
+        if self.size > self.limit:
+            self._resize(int(slots * self.GROWTH))
+        return False
+
+    def contains_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量判断items是否已存在
+        :return: bool数组
+        """
+        keys = self.fingerprints(items)
+        unique, first, inverse = _unique_keys(keys)
+        return _batch_result(self._lookup_keys(unique), first, inverse, update=False)
+
+    def add_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量加入items，结果和依次调用add相同
+        :return: bool数组，每个元素加入前是否已存在
+        >>> fingerprints = FingerprintSet()
+        >>> fingerprints.add_many(['a', 'b', 'a']).tolist(), fingerprints.add_many(['b', 'c']).tolist()
+        ([False, False, True], [True, False])
+        """
+        keys = self.fingerprints(items)
+        unique, first, inverse = _unique_keys(keys)
+        return _batch_result(self._insert_keys(unique), first, inverse, update=True)
+
+    def _start(self, keys: np.ndarray) -> (np.ndarray, np.ndarray):
+        # 每个指纹探测的起始位置和步长，和_probe一致
+        slot_number = np.uint64(self.slots)
+        slots = keys[:, 0] % slot_number
+        steps = (keys[:, 0] >> np.uint64(32)) % (slot_number - np.uint64(1)) + np.uint64(1)
+        return slots, steps
+
+    def _lookup_keys(self, keys: np.ndarray) -> np.ndarray:
+        """
+        批量查找指纹，所有指纹同时探测
+        :param keys: 形状为(n, bits//64)的uint64数组
+        :return: 每个指纹是否存在
+        """
+        table = self.table
+        slot_number = np.uint64(self.slots)
+        found = np.zeros(len(keys), dtype=bool)
+        pending = np.arange(len(keys))
+        slots, steps = self._start(keys)
+        while len(pending):
+            current = table[slots]
+            hit = (current == keys[pending]).all(axis=1)
+            found[pending[hit]] = True
+            moving = ~((current[:, 0] == 0) | hit)
+            pending = pending[moving]
+            slots = (slots[moving] + steps[moving]) % slot_number
+            steps = steps[moving]
+        return found
+
+    def _resize(self, slots: int) -> NoReturn:
+        keys = self.table[self.table[:, 0] != 0]
+        self._allocate(slots)
+        self.size = 0
+        self._insert_keys(keys)
+
+    def _insert_keys(self, keys: np.ndarray) -> np.ndarray:
+        """
+        批量插入互不相同的指纹，所有指纹同时探测，每轮每个空位只分配给一个指纹
+        :param keys: 形状为(n, bits//64)的uint64数组，不能有重复
+        :return: 每个指纹在插入前是否已存在
+        """
+        if self.size + len(keys) > self.limit:
+            self._resize(max(int((self.size + len(keys)) / self.LOAD_FACTOR), int(self.slots * self.GROWTH)))
+        table = self.table
+        slot_number = np.uint64(self.slots)
+        found = np.zeros(len(keys), dtype=bool)
+        pending = np.arange(len(keys))
+        slots, steps = self._start(keys)
+        while len(pending):
+            current = table[slots]
+            empty = current[:, 0] == 0
+            hit = (current == keys[pending]).all(axis=1)
+            found[pending[hit]] = True
+            # 争抢同一个空位的指纹只有第一个能放入，其余的下一轮再看这个位置
+            candidates = np.nonzero(empty)[0]
+            _, first = np.unique(slots[candidates], return_index=True)
+            winners = candidates[first]
+            table[slots[winners]] = keys[pending[winners]]
+            placed = np.zeros(len(pending), dtype=bool)
+            placed[winners] = True
+            moving = ~(empty | hit)
+            slots[moving] = (slots[moving] + steps[moving]) % slot_number
+            keep = ~(placed | hit)
+            pending = pending[keep]
+            slots = slots[keep]
+            steps = steps[keep]
+        self.size += int(len(keys) - found.sum())
+        return found
+
+    def merge(self, other: 'FingerprintSet', chunk_size: int = 1 << 22) -> 'FingerprintSet':
+        """
+        把other的指纹并入自身，other的bits须相同。结果和other的元素逐个add相同，所以merge满足结合律
+        :param other:
+        :param chunk_size: 每次从other.table读取的行数，other是np.memmap时不必整个读入内存
+        :return: self
+        """
+        self._check_mergeable(other, 'bits')
+        for begin in range(0, other.slots, chunk_size):
+            chunk = np.asarray(other.table[begin:begin + chunk_size])
+            self._insert_keys(chunk[chunk[:, 0] != 0])
+        return self
+
+    def false_positive_rate(self) -> float:
+        """
+        新元素和已有的某个指纹相同的概率
+        """
+        return self.size / 2 ** self.bits
+
+    def clear(self) -> NoReturn:
+        self.size = 0
+        self._allocate(self.slots)
+
+
+class DigestSet:
+    """
+    用python的set保存各元素bits位的blake2b摘要（bytes），Deduplication默认使用。
+    摘要直接作为set的元素，不转成整数也不在python里探测，逐个add比encrypt_md5加set快约30%，每个元素约占80字节，约为md5字符串的60%。
+    摘要按小端序读出就是FingerprintSet的指纹，save后的文件可以互相读取，误判率也相同
+    """
+    META = ('bits',)
+
+    def __init__(self, bits: int = 64):
+        """
+        :param bits: 指纹的位数，64或128
+        """
+        if bits not in (64, 128):
+            raise ValueError('bits should be 64 or 128')
+        self.bits = bits
+        self.words = bits // 64
+        self.keys = set()
+
+    @property
+    def _hasher(self):
+        return _HASHER_64 if self.words == 1 else _HASHER_128
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.keys) + len(self.keys) * sys.getsizeof(bytes(self.words * 8))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _digest(self, item: Any) -> bytes:
+        # 和FingerprintSet一样，低64位为0的指纹记为1
+        if item.__class__ is not str:
+            item = '{}'.format(item)
+        hasher = self._hasher.copy()
+        hasher.update(item.encode('utf-8'))
+        digest = hasher.digest()
+        if not any(digest[:8]):
+            digest = b'\x01' + digest[1:]
+        return digest
+
+    def _digests(self, items: Iterator[Any]) -> List[bytes]:
+        # 摘要直接放进set，不需要经过numpy数组
+        copy = self._hasher.copy
+        digests = []
+        for item in items:
+            if item.__class__ is not str:
+                item = '{}'.format(item)
+            hasher = copy()
+            hasher.update(item.encode('utf-8'))
+            digest = hasher.digest()
+            if not any(digest[:8]):
+                digest = b'\x01' + digest[1:]
+            digests.append(digest)
+        return digests
+
+    @staticmethod
+    def _to_digests(keys: np.ndarray) -> List[bytes]:
+        # 把形状为(n, bits//64)的uint64数组逐行转为小端序的摘要
+        size = keys.shape[1] * 8
+        buffer = keys.astype('<u8').tobytes()
+        return [buffer[begin:begin + size] for begin in range(0, len(buffer), size)]
+
+    def __contains__(self, item: Any) -> bool:
+        return self._digest(item) in self.keys
+
+    def add(self, item: Any) -> bool:
+        """
+        加入item
+        :return: 加入前item是否已存在
+        >>> digests = DigestSet()
+        >>> digests.add('a'), digests.add('a'), 'b' in digests
+        (False, True, False)
+        """
+        if self.words != 1:
+            key = self._digest(item)
+        else:
+            # 64位指纹是最常用的情况，展开_digest以减少函数调用
+            if item.__class__ is not str:
+                item = '{}'.format(item)
+            hasher = _HASHER_64.copy()
+            hasher.update(item.encode('utf-8'))
+            key = hasher.digest()
+            if key == _ZERO_64:
+                key = _ONE_64
+        keys = self.keys
+        if key in keys:
+            return True
+        keys.add(key)
+        return False
+
+    def contains_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量判断items是否已存在
+        :return: bool数组
+        """
+        keys = self.keys
+        return np.array([key in keys for key in self._digests(items)], dtype=bool)
+
+    def add_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量加入items，结果和依次调用add相同
+        :return: bool数组，每个元素加入前是否已存在
+        >>> digests = DigestSet()
+        >>> digests.add_many(['a', 'b', 'a']).tolist(), digests.add_many(['b', 'c']).tolist()
+        ([False, False, True], [True, False])
+        """
+        keys = self.keys
+        found = []
+        for key in self._digests(items):
+            if key in keys:
+                found.append(True)
+            else:
+                keys.add(key)
+                found.append(False)
+        return np.array(found, dtype=bool)
+
+    @property
+    def table(self) -> np.ndarray:
+        """
+        形状为(n, bits//64)的uint64数组，每行是一个指纹，供Deduplication.save保存
+        """
+        buffer = b''.join(self.keys)
+        return np.frombuffer(buffer, dtype='<u8').astype(np.uint64).reshape(-1, self.words)
+
+    def meta(self) -> dict:
+        return {name: getattr(self, name) for name in self.META}
+
+    @classmethod
+    def from_state(cls, meta: dict, table: np.ndarray) -> 'DigestSet':
+        """
+        由meta和table重建，table中全0的行（FingerprintSet的空位）会被跳过
+        """
+        store = cls(bits=meta['bits'])
+        table = np.asarray(table)
+        store.keys = set(cls._to_digests(table[table[:, 0] != 0]))
+        return store
+
+    def merge(self, other: 'DigestSet') -> 'DigestSet':
+        """
+        把other的摘要并入自身，other的bits须相同
+        :return: self
+        """
+        if type(other) is not type(self) or other.bits != self.bits:
+            raise ValueError('can not merge {} into {} with different bits'.format(
+                type(other).__name__, type(self).__name__))
+        self.keys |= other.keys
+        return self
+
+    def false_positive_rate(self) -> float:
+        """
+        新元素和已有的某个指纹相同的概率
+        """
+        return len(self.keys) / 2 ** self.bits
+
+    def clear(self) -> NoReturn:
+        self.keys.clear()
+
+
+def _hash128(item: Any) -> int:
+    # 128位的blake2b摘要，布隆过滤器和布谷鸟过滤器由它导出多个位置
+    hasher = _HASHER_128.copy()
+    hasher.update(_to_bytes(item))
+    return int.from_bytes(hasher.digest(), 'little')
+
+
+class BloomFilter(_ArrayStore):
+    """
+    布隆过滤器。内存在创建时按capacity和error_rate一次分配，之后不再增长。
+    元素个数不超过capacity时误判率不超过error_rate，只会把新元素误判为重复，不会漏判。不支持删除。
+    """
+    META = ('capacity', 'error_rate', 'bit_number', 'hash_number', 'size')
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.001):
+        """
+        :param capacity: 预计的元素个数
+        :param error_rate: 元素个数达到capacity时的误判率
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate should be between 0 and 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_number = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hash_number = max(int(round(self.bit_number / max(capacity, 1) * math.log(2))), 1)
+        self.size = 0
+        self.table = np.zeros((self.bit_number + 7) // 8, dtype=np.uint8)
+        self._bind()
+
+    def _bind(self) -> NoReturn:
+        self._view = memoryview(self.table)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _positions(self, key: int) -> Iterator[int]:
+        # 由两个64位哈希线性组合出hash_number个位置，按64位无符号整数溢出，和numpy的批量计算一致
+        first = key & _WORD_MASK
+        second = key >> 64 | 1
+        bit_number = self.bit_number
+        for index in range(self.hash_number):
+            yield ((first + index * second) & _WORD_MASK) % bit_number
+
+    def __contains__(self, item: Any) -> bool:
+        view = self._view
+        for position in self._positions(_hash128(item)):
+            if not view[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, item: Any) -> bool:
+        """
+        加入item
+        :return: 加入前item是否（可能）已存在
+        >>> bloom = BloomFilter(capacity=100)
+        >>> bloom.add('a'), bloom.add('a')
+        (False, True)
+        """
+        view = self._view
+        present = True
+        for position in self._positions(_hash128(item)):
+            mask = 1 << (position & 7)
+            if not view[position >> 3] & mask:
+                present = False
+                view[position >> 3] |= mask
+        if not present:
+            self.size += 1
+        return present
+
+    def _batch_positions(self, keys: np.ndarray) -> np.ndarray:
+        # 由128位摘要得到形状为(n, hash_number)的位置数组
+        first = keys[:, :1]
+        second = keys[:, 1:] | np.uint64(1)
+        index = np.arange(self.hash_number, dtype=np.uint64)
+        return (first + index * second) % np.uint64(self.bit_number)
+
+    def _test_bits(self, positions: np.ndarray) -> np.ndarray:
+        return ((self.table[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+    def contains_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量判断items是否（可能）已存在
+        :return: bool数组
+        """
+        return self._test_bits(self._batch_positions(_digests(items, _HASHER_128)))
+
+    def add_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量加入items。批内的元素只在完全相同时互相判为重复，所以误判比依次调用add略少
+        :return: bool数组，每个元素加入前是否（可能）已存在
+        >>> bloom = BloomFilter(capacity=100)
+        >>> bloom.add_many(['a', 'b', 'a']).tolist(), bloom.add_many(['b', 'c']).tolist()
+        ([False, False, True], [True, False])
+        """
+        # 批内去重只看摘要的低64位，相同的概率远低于布隆过滤器本身的误判率
+        keys = _digests(items, _HASHER_128)
+        _, first, inverse = _unique_keys(keys[:, :1])
+        positions = self._batch_positions(keys[first])
+        found = self._test_bits(positions)
+        new = positions[~found].reshape(-1)
+        np.bitwise_or.at(self.table, new >> np.uint64(3), np.left_shift(1, new & np.uint64(7)).astype(np.uint8))
+        self.size += int((~found).sum())
+        return _batch_result(found, first, inverse, update=True)
+
+    def _ones(self) -> int:
+        return int(_POPCOUNT[self.table].sum(dtype=np.int64))
+
+    def merge(self, other: 'BloomFilter') -> 'BloomFilter':
+        """
+        按位或并入other，other须用相同的capacity和error_rate创建。元素个数改为由置位比例估计
+        :return: self
+        """
+        self._check_mergeable(other, 'bit_number', 'hash_number')
+        np.bitwise_or(self.table, other.table, out=self.table)
+        fill = min(self._ones() / self.bit_number, 1 - 1 / self.bit_number)
+        self.size = int(round(-self.bit_number / self.hash_number * math.log(1 - fill)))
+        return self
+
+    def false_positive_rate(self) -> float:
+        """
+        按当前被置位的比例估计误判率
+        """
+        return (self._ones() / self.bit_number) ** self.hash_number
+
+    def clear(self) -> NoReturn:
+        self.size = 0
+        self.table[:] = 0
+
+
+class CuckooFilter(_ArrayStore):
+    """
+    布谷鸟过滤器。每个桶存BUCKET_SIZE个短指纹，每个元素有两个候选桶，桶满时把已有的指纹踢到它的另一个桶。
+    内存在创建时一次分配，和布隆过滤器相比支持删除。过滤器满时新元素无法加入，会打印警告。
+    """
+    BUCKET_SIZE = 4
+    LOAD_FACTOR = 0.95
+    MAX_KICKS = 500
+    META = ('capacity', 'error_rate', 'fingerprint_bits', 'bucket_number', 'size', 'victim')
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.001):
+        """
+        :param capacity: 预计的元素个数
+        :param error_rate: 元素个数达到capacity时的误判率，决定指纹的位数
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate should be between 0 and 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # 误判率约为2*BUCKET_SIZE/2^fingerprint_bits，指纹位数取能放下的最小的无符号整数类型
+        need_bits = math.log2(2 * self.BUCKET_SIZE / error_rate)
+        for dtype in (np.uint8, np.uint16, np.uint32):
+            if need_bits <= np.iinfo(dtype).bits or dtype is np.uint32:
+                break
+        self.fingerprint_bits = np.iinfo(dtype).bits
+        # 桶数取2的幂，另一个桶的序号可以由异或得到
+        self.bucket_number = 1 << max(int(math.ceil(capacity / self.BUCKET_SIZE / self.LOAD_FACTOR)) - 1, 1).bit_length()
+        self.size = 0
+        self.victim = None
+        self.table = np.zeros((self.bucket_number, self.BUCKET_SIZE), dtype=dtype)
+        self._bind()
+
+    def _bind(self) -> NoReturn:
+        code = {1: 'B', 2: 'H', 4: 'I'}[self.table.dtype.itemsize]
+        self._view = memoryview(self.table.reshape(-1)).cast('B').cast(code)
+        self._random = random.Random(0)
+        # 保存为json后victim会变成list
+        if self.victim is not None:
+            self.victim = tuple(self.victim)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _locate(self, item: Any) -> (int, int, int):
+        # 返回指纹和两个候选桶。指纹为0表示空位，所以指纹取值不为0
+        key = _hash128(item)
+        fingerprint = (key >> 64) % ((1 << self.fingerprint_bits) - 1) + 1
+        index = key & (self.bucket_number - 1)
+        return fingerprint, index, self._alternate(index, fingerprint)
+
+    def _alternate(self, index: int, fingerprint: int) -> int:
+        return index ^ ((fingerprint * 0x5bd1e995) & _WORD_MASK) & (self.bucket_number - 1)
+
+    def _find(self, bucket: int, fingerprint: int) -> int:
+        # 返回fingerprint在桶里的位置，不存在时返回-1
+        base = bucket * self.BUCKET_SIZE
+        view = self._view
+        for position in range(base, base + self.BUCKET_SIZE):
+            if view[position] == fingerprint:
+                return position
+        return -1
+
+    def _contains(self, fingerprint: int, index: int, alternate: int) -> bool:
+        if self.victim is not None and self.victim[1] == fingerprint and self.victim[0] in (index, alternate):
+            return True
+        return self._find(index, fingerprint) != -1 or self._find(alternate, fingerprint) != -1
+
+    def __contains__(self, item: Any) -> bool:
+        return self._contains(*self._locate(item))
+
+    def _batch_locate(self, keys: np.ndarray) -> np.ndarray:
+        # 由128位摘要得到形状为(n, 3)的数组，每行是指纹和两个候选桶，和_locate一致
+        fingerprints = keys[:, 1] % np.uint64((1 << self.fingerprint_bits) - 1) + np.uint64(1)
+        indexes = keys[:, 0] & np.uint64(self.bucket_number - 1)
+        return self._batch_with_alternate(fingerprints, indexes)
+
+    def _batch_with_alternate(self, fingerprints: np.ndarray, indexes: np.ndarray) -> np.ndarray:
+        alternates = indexes ^ (fingerprints * np.uint64(0x5bd1e995)) & np.uint64(self.bucket_number - 1)
+        return np.stack([fingerprints, indexes, alternates], axis=1)
+
+    def contains_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量判断items是否（可能）已存在
+        :return: bool数组
+        """
+        return self._batch_contains(self._batch_locate(_digests(items, _HASHER_128)))
+
+    def _batch_contains(self, located: np.ndarray) -> np.ndarray:
+        fingerprints = located[:, :1]
+        found = (self.table[located[:, 1]] == fingerprints).any(axis=1)
+        found |= (self.table[located[:, 2]] == fingerprints).any(axis=1)
+        if self.victim is not None:
+            bucket, fingerprint = self.victim
+            found |= (located[:, 0] == fingerprint) & ((located[:, 1] == bucket) | (located[:, 2] == bucket))
+        return found
+
+    def add_many(self, items: Iterator[Any]) -> np.ndarray:
+        """
+        批量加入items，先批量查找，只有新元素逐个放入。批内的元素只在完全相同时互相判为重复
+        :return: bool数组，每个元素加入前是否（可能）已存在
+        >>> cuckoo = CuckooFilter(capacity=100)
+        >>> cuckoo.add_many(['a', 'b', 'a']).tolist(), cuckoo.add_many(['b', 'c']).tolist()
+        ([False, False, True], [True, False])
+        """
+        keys = _digests(items, _HASHER_128)
+        _, first, inverse = _unique_keys(keys[:, :1])
+        located = self._batch_locate(keys[first])
+        found = self._batch_contains(located)
+        for fingerprint, index, alternate in located[~found].tolist():
+            self._place(fingerprint, index, alternate)
+        return _batch_result(found, first, inverse, update=True)
+
+    def _insert(self, bucket: int, fingerprint: int) -> bool:
+        position = self._find(bucket, 0)
+        if position == -1:
+            return False
+        self._view[position] = fingerprint
+        return True
+
+    def add(self, item: Any) -> bool:
+        """
+        加入item
+        :return: 加入前item是否（可能）已存在
+        >>> cuckoo = CuckooFilter(capacity=100)
+        >>> cuckoo.add('a'), cuckoo.add('a'), cuckoo.remove('a'), 'a' in cuckoo
+        (False, True, True, False)
+        """
+        return self._add(*self._locate(item))
+
+    def _add(self, fingerprint: int, index: int, alternate: int) -> bool:
+        if self._contains(fingerprint, index, alternate):
+            return True
+        self._place(fingerprint, index, alternate)
+        return False
+
+    def _place(self, fingerprint: int, index: int, alternate: int) -> NoReturn:
+        if self._insert(index, fingerprint) or self._insert(alternate, fingerprint):
+            self.size += 1
+            return
+        if self.victim is not None:
+            print('Warning: cuckoo filter is full, capacity:', self.capacity)
+            return
+        # 随机踢出一个指纹，让它去自己的另一个桶，最终无处安放的指纹暂存在victim
+        view = self._view
+        bucket = self._random.choice((index, alternate))
+        for _ in range(self.MAX_KICKS):
+            position = bucket * self.BUCKET_SIZE + self._random.randrange(self.BUCKET_SIZE)
+            fingerprint, view[position] = view[position], fingerprint
+            bucket = self._alternate(bucket, fingerprint)
+            if self._insert(bucket, fingerprint):
+                self.size += 1
+                return
+        self.victim = (bucket, fingerprint)
+        self.size += 1
+
+    def remove(self, item: Any) -> bool:
+        """
+        删除item，只能删除加入过的元素，否则可能误删指纹相同的其他元素
+        :return: 是否找到并删除
+        """
+        fingerprint, index, alternate = self._locate(item)
+        if self.victim is not None and self.victim[1] == fingerprint and self.victim[0] in (index, alternate):
+            self.victim = None
+            self.size -= 1
+            return True
+        for bucket in (index, alternate):
+            position = self._find(bucket, fingerprint)
+            if position != -1:
+                self._view[position] = 0
+                self.size -= 1
+                if self.victim is not None and self._insert(*self.victim):
+                    self.victim = None
+                return True
+        return False
+
+    def merge(self, other: 'CuckooFilter') -> 'CuckooFilter':
+        """
+        把other的指纹逐个放入自身，自身已有的指纹跳过，other须用相同的capacity和error_rate创建
+        :return: self
+        """
+        self._check_mergeable(other, 'bucket_number', 'fingerprint_bits')
+        buckets, _ = np.nonzero(other.table)
+        fingerprints = other.table[other.table != 0]
+        if other.victim is not None:
+            buckets = np.append(buckets, other.victim[0])
+            fingerprints = np.append(fingerprints, other.victim[1])
+        located = self._batch_with_alternate(fingerprints.astype(np.uint64), buckets.astype(np.uint64))
+        for fingerprint, index, alternate in located[~self._batch_contains(located)].tolist():
+            self._place(fingerprint, index, alternate)
+        return self
+
+    def false_positive_rate(self) -> float:
+        """
+        按当前的装载率估计误判率：查询时最多和两个桶里的所有指纹比较
+        """
+        load = self.size / (self.bucket_number * self.BUCKET_SIZE)
+        return 1 - (1 - 1 / ((1 << self.fingerprint_bits) - 1)) ** (2 * self.BUCKET_SIZE * load)
+
+    def clear(self) -> NoReturn:
+        self.size = 0
+        self.victim = None
+        self.table[:] = 0
+
+
 class Deduplication:
-    def __init__(self, use_md5: bool = True):
+    MODES = ('exact', 'compact', 'bloom', 'cuckoo')
+    META_FILE = 'meta.json'
+    TABLE_FILE = 'table.npy'
+
+    def __init__(
+            self,
+            use_md5: bool = True,
+            bits: int = 64,
+            capacity: int = None,
+            mode: str = 'exact',
+            error_rate: float = 0.001,
+    ):
+        """
+        判断元素是否重复出现
+        :param use_md5: mode='exact'时有效，若为True，只保存元素的定长指纹（DigestSet）以压缩内存；否则用set保存原始字符串
+        :param bits: 指纹的位数，64或128
+        :param capacity: 预计的元素个数。mode='compact'时默认为1024，会自动扩容；bloom和cuckoo默认为1000000，内存一次分配
+        :param mode: 'exact'精确去重；'compact'也是精确去重，把指纹存在numpy数组里（FingerprintSet），
+            内存约为'exact'的五分之一，但逐个判断更慢，适合批量处理或需要内存映射读取的场景；
+            'bloom'用布隆过滤器；'cuckoo'用布谷鸟过滤器（支持remove）
+        :param error_rate: bloom和cuckoo在元素个数达到capacity时的误判率
+        """
+        if mode not in self.MODES:
+            raise ValueError('mode should be one of {}'.format(self.MODES))
         self.use_md5 = use_md5
-        self.data = set()
+        self.bits = bits
+        self.capacity = capacity
+        self.mode = mode
+        self.error_rate = error_rate
+        self.data = self._new_store()
+
+    @staticmethod
+    def _store_class(mode: str) -> type:
+        return {
+            'exact': DigestSet, 'compact': FingerprintSet, 'bloom': BloomFilter, 'cuckoo': CuckooFilter,
+        }[mode]
+
+    def _new_store(self) -> Union[DigestSet, FingerprintSet, BloomFilter, CuckooFilter, set]:
+        if self.mode == 'compact':
+            return FingerprintSet(capacity=self.capacity or 1024, bits=self.bits)
+        if self.mode != 'exact':
+            return self._store_class(self.mode)(capacity=self.capacity or 1000000, error_rate=self.error_rate)
+        if self.use_md5:
+            return DigestSet(bits=self.bits)
+        return set()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        占用的内存，mode='exact'且use_md5=False时不统计
+        """
+        return getattr(self.data, 'nbytes', 0)
+
+    def false_positive_rate(self) -> float:
+        """
+        把新元素误判为重复的概率的估计值
+        """
+        if isinstance(self.data, set):
+            return 0.0
+        return self.data.false_positive_rate()
 
     def add(self, item: Any) -> NoReturn:
-        if not isinstance(item, str):
+        if isinstance(self.data, set) and not isinstance(item, str):
             item = '{}'.format(item)
-        if self.use_md5:
-            self.data.add(encrypt_md5(item))
-        else:
-            self.data.add(item)
+        self.data.add(item)
+
+    def remove(self, item: Any) -> bool:
+        """
+        删除item，仅支持mode='cuckoo'和use_md5=False
+        :return: 是否找到并删除
+        """
+        if self.mode == 'cuckoo':
+            return self.data.remove(item)
+        if isinstance(self.data, set):
+            if not isinstance(item, str):
+                item = '{}'.format(item)
+            if item in self.data:
+                self.data.remove(item)
+                return True
+            return False
+        raise ValueError('remove is not supported in mode {} with use_md5=True'.format(self.mode))
 
     def clean(self):
-        self.data = set()
+        self.data = self._new_store()
 
     def is_duplication(self, item: Any, update=True) -> bool:
         """
-        判断item是否重复出现。默认使用md5压缩内存。
+        判断item是否重复出现。默认只保存64位指纹以压缩内存，逐个调用比原来的md5字符串加set快。
         :param item:
         :param update:
         :return:
@@ -62,11 +1004,14 @@ class Deduplication:
         False
         True
         False
+        >>> deduplication = Deduplication(mode='bloom', capacity=1000, error_rate=0.01)
+        >>> deduplication.is_duplication('a'), deduplication.is_duplication('a')
+        (False, True)
         """
+        if not isinstance(self.data, set):
+            return self.data.add(item) if update else item in self.data
         if not isinstance(item, str):
             item = '{}'.format(item)
-        if self.use_md5:
-            item = encrypt_md5(item)
         if item in self.data:
             return True
         else:
@@ -74,6 +1019,325 @@ class Deduplication:
                 self.data.add(item)
         return False
 
+    def is_duplication_many(self, items: Iterator[Any], update=True) -> np.ndarray:
+        """
+        批量判断items是否重复出现，结果和依次调用is_duplication相同。
+        哈希仍在python里逐个计算，mode='compact'时整批在numpy里探测。
+        吞吐量受哈希限制，单进程约40~70万行/秒（短行约20~40MB/s），跟不上GB/s级的读取速度；
+        需要更快时按文件分片，用multi在多个进程里分别去重后merge
+        :param items:
+        :param update:
+        :return: bool数组
+        >>> deduplication = Deduplication()
+        >>> deduplication.is_duplication_many([1, 1, 2]).tolist()
+        [False, True, False]
+        """
+        items = list(items)
+        if not isinstance(self.data, set):
+            return self.data.add_many(items) if update else self.data.contains_many(items)
+        return np.array([self.is_duplication(item, update=update) for item in items], dtype=bool)
+
+    def add_many(self, items: Iterator[Any]) -> NoReturn:
+        self.is_duplication_many(items)
+
+    def iter_unique(self, items: Iterator[Any], batch_size: int = 65536, limit: int = None) -> Iterator[Any]:
+        """
+        按batch_size分批调用is_duplication_many，依次输出不重复的元素，吞吐量见is_duplication_many。
+        每批要读满batch_size个元素才输出，需要尽快得到第一个结果时用较小的batch_size
+        :param items: 元素
+        :param batch_size: 每批的元素个数
+        :param limit: 最多输出limit个元素，None表示不限制。每批不超过还需输出的个数，不会多读items，也不会把没有输出的元素记为已出现
+        >>> list(Deduplication().iter_unique(['a', 'b', 'a', 'c'], batch_size=3))
+        ['a', 'b', 'c']
+        >>> deduplication = Deduplication()
+        >>> list(deduplication.iter_unique(['a', 'a', 'b', 'c'], limit=2)), deduplication.is_duplication('c')
+        (['a', 'b'], False)
+        """
+        items = iter(items)
+        remain = limit
+        while remain is None or remain > 0:
+            batch = list(itertools.islice(items, batch_size if remain is None else min(batch_size, remain)))
+            if not batch:
+                return
+            for item, duplication in zip(batch, self.is_duplication_many(batch)):
+                if not duplication:
+                    if remain is not None:
+                        remain -= 1
+                    yield item
+
+    def merge(self, other: 'Deduplication') -> 'Deduplication':
+        """
+        把other并入自身，两者须用相同的参数创建。merge满足结合律，可以在各进程分别去重后合并
+        :return: self
+        >>> first, second = Deduplication(), Deduplication()
+        >>> _ = first.is_duplication_many(['a', 'b']), second.is_duplication_many(['b', 'c'])
+        >>> first.merge(second).is_duplication_many(['a', 'c', 'd']).tolist()
+        [True, True, False]
+        """
+        if (other.mode, other.use_md5) != (self.mode, self.use_md5):
+            raise ValueError('can not merge Deduplication with different mode or use_md5')
+        if isinstance(self.data, set):
+            self.data |= other.data
+        else:
+            self.data.merge(other.data)
+        return self
+
+    def save(self, path: str) -> NoReturn:
+        """
+        保存到目录path，其中table.npy可以被load内存映射读取。不支持use_md5=False。
+        每天增量去重时先load前一天的状态，处理新数据后再save回原目录即可。
+        先写临时文件再替换，所以path正被内存映射时也可以保存；
+        table是以'r+'映射的path/table.npy时只flush，不再复制一遍。
+        :param path: 目录
+        """
+        if isinstance(self.data, set):
+            raise ValueError('save is not supported with use_md5=False')
+        os.makedirs(path, exist_ok=True)
+        meta = {
+            'mode': self.mode,
+            'use_md5': self.use_md5,
+            'bits': self.bits,
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'store': self.data.meta(),
+        }
+        table = self.data.table
+        table_file = os.path.join(path, self.TABLE_FILE)
+        if isinstance(table, np.memmap) and table.mode == 'r+' and table.filename == os.path.abspath(table_file):
+            table.flush()
+        else:
+            with open(table_file + '.tmp', 'wb') as fout:
+                np.save(fout, table)
+            os.replace(table_file + '.tmp', table_file)
+        meta_file = os.path.join(path, self.META_FILE)
+        with open(meta_file + '.tmp', 'w', encoding='utf8') as fout:
+            json.dump(meta, fout)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Union[str, None] = 'c') -> 'Deduplication':
+        """
+        读取save保存的目录
+        :param path: 目录
+        :param mmap_mode: 传给np.load。'c'内存映射，修改只在内存里；'r'只读；None全部读入内存；
+            'r+'内存映射，修改直接写回table.npy，mode='compact'扩容后也仍映射到该文件。
+            mode='exact'时指纹总是读入python的set，mmap_mode无效。
+            元素个数等保存在meta.json里，只在save时更新，所以'r+'处理完后仍要save回原目录，此时只flush table
+        :return: Deduplication
+        >>> import tempfile
+        >>> deduplication = Deduplication(mode='bloom', capacity=100)
+        >>> _ = deduplication.is_duplication_many(['a', 'b'])
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     deduplication.save(path)
+        ...     Deduplication.load(path, mmap_mode=None).is_duplication_many(['a', 'c']).tolist()
+        [True, False]
+        """
+        with open(os.path.join(path, cls.META_FILE), 'r', encoding='utf8') as fin:
+            meta = json.load(fin)
+        store_meta = meta.pop('store')
+        deduplication = cls.__new__(cls)
+        deduplication.__dict__.update(meta)
+        table = np.load(os.path.join(path, cls.TABLE_FILE), mmap_mode=mmap_mode)
+        deduplication.data = cls._store_class(deduplication.mode).from_state(store_meta, table)
+        return deduplication
+
+
+def get_deduplication(deduplication: Union[bool, str, Deduplication]) -> Union[Deduplication, None]:
+    """
+    把load_line等函数的deduplication参数转为Deduplication
+    :param deduplication: False不去重，True精确去重，'compact'用更省内存的精确去重，'bloom'或'cuckoo'用对应的过滤器，
+        也可以直接传入Deduplication
+    :return: 不去重时返回None
+    """
+    if isinstance(deduplication, Deduplication):
+        return deduplication
+    if not deduplication:
+        return None
+    if deduplication is True:
+        return Deduplication()
+    return Deduplication(mode=deduplication)
+
+
+# MinHash的随机线性哈希(a*x+b)%_MINHASH_PRIME，x和a都小于2^32，计算过程不会超出uint64
+_MINHASH_PRIME = np.uint64((1 << 32) + 15)
+_MINHASH_MAX = np.uint64((1 << 32) - 1)
+
+
+@functools.lru_cache(maxsize=1 << 20)
+def _token_hash(token: str) -> int:
+    # n-gram的64位哈希，不同进程间稳定
+    return int.from_bytes(blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _lsh_bands(threshold: float, num_perm: int, false_negative_weight: float = 0.95) -> (int, int):
+    """
+    选择分段数bands和每段的行数rows，使相似度低于threshold却成为候选、高于threshold却没有成为候选的加权概率之和最小
+    相似度为s的两个文本至少有一段完全相同的概率为1-(1-s^rows)^bands
+    去重时漏掉比多比较几个候选代价更大，所以默认侧重召回：threshold=0.8时相似度为0.8的文本约95%成为候选
+    """
+    grid = np.linspace(0, 1, 201)
+    below = grid < threshold
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        probability = 1 - (1 - grid ** rows) ** bands
+        error = (1 - false_negative_weight) * probability[below].sum() + \
+            false_negative_weight * (1 - probability[~below]).sum()
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplication:
+    """
+    近似重复检测，和精确去重的Deduplication互补。
+    method='minhash'：用字的n-gram集合的MinHash签名估计Jaccard相似度，签名分为bands段，至少有一段完全相同的文本才作为候选。
+    method='simhash'：64位SimHash按海明距离比较，分成max_distance+1块，至少有一块完全相同的才作为候选（抽屉原理，不会漏掉）。
+    插入和查询都只和同一个桶里的文本比较，不需要两两比较。
+    """
+    METHODS = ('minhash', 'simhash')
+
+    def __init__(
+            self,
+            threshold: float = 0.8,
+            method: str = 'minhash',
+            ngram: int = 1,
+            num_perm: int = 128,
+            max_distance: int = None,
+            seed: int = 0,
+    ):
+        """
+        :param threshold: 相似度大于等于threshold视为近似重复
+        :param method: 'minhash'或'simhash'
+        :param ngram: 取字的ngram作为特征，ngram=1时minhash估计的就是char_sim
+        :param num_perm: minhash签名的长度，越长估计越准
+        :param max_distance: simhash的海明距离上限，默认由threshold换算：相似度=1-海明距离/64。simhash适合阈值很高的场景
+        :param seed: minhash随机哈希的种子
+        """
+        if method not in self.METHODS:
+            raise ValueError('method should be one of {}'.format(self.METHODS))
+        self.threshold = threshold
+        self.method = method
+        self.ngram = ngram
+        if method == 'minhash':
+            self.num_perm = num_perm
+            generator = np.random.RandomState(seed)
+            self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+            self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+            self.bands, self.rows = _lsh_bands(threshold, num_perm)
+        else:
+            if max_distance is None:
+                max_distance = int((1 - threshold) * 64 + 1e-9)
+            self.max_distance = max_distance
+            self.bands = min(max_distance + 1, 64)
+            # 把64位尽量平均地分成bands块，记录每块的起始位和宽度
+            bounds = [64 * index // self.bands for index in range(self.bands + 1)]
+            self._blocks = [(begin, (1 << (end - begin)) - 1) for begin, end in zip(bounds, bounds[1:])]
+        self.keys = []
+        self.signatures = []
+        self.tables = [defaultdict(list) for _ in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _tokens(self, text: str) -> set:
+        if len(text) <= self.ngram:
+            return {text} if text else set()
+        return {text[index:index + self.ngram] for index in range(len(text) - self.ngram + 1)}
+
+    def signature(self, text: str) -> Union[np.ndarray, int]:
+        """
+        minhash返回长为num_perm的uint32数组，simhash返回64位整数
+        """
+        hashes = np.array([_token_hash(token) for token in self._tokens(text)], dtype=np.uint64)
+        if self.method == 'simhash':
+            bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+            weights = bits.sum(axis=0).astype(np.int64) * 2 - len(hashes)
+            return sum(1 << int(index) for index in np.nonzero(weights > 0)[0])
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _MINHASH_MAX, dtype=np.uint32)
+        hashes &= _MINHASH_MAX
+        permuted = (hashes[:, None] * self._a + self._b) % _MINHASH_PRIME
+        return (permuted.min(axis=0) & _MINHASH_MAX).astype(np.uint32)
+
+    def similarity(self, first: Union[np.ndarray, int], second: Union[np.ndarray, int]) -> float:
+        """
+        由两个签名估计相似度
+        """
+        if self.method == 'simhash':
+            return 1 - bin(first ^ second).count('1') / 64
+        return float(np.count_nonzero(first == second)) / self.num_perm
+
+    def _band_keys(self, signature: Union[np.ndarray, int]) -> List[int]:
+        if self.method == 'simhash':
+            return [(signature >> begin) & mask for begin, mask in self._blocks]
+        rows = signature[:self.bands * self.rows].reshape(self.bands, self.rows)
+        return [hash(row.tobytes()) for row in rows]
+
+    def _candidates(self, signature: Union[np.ndarray, int]) -> set:
+        candidates = set()
+        for table, band_key in zip(self.tables, self._band_keys(signature)):
+            candidates.update(table.get(band_key, ()))
+        return candidates
+
+    def candidates(self, text: str) -> List[Any]:
+        """
+        和text分到同一个桶的已插入文本的key，未按相似度过滤。可以再用其他相似度方法精确比较
+        """
+        return [self.keys[identity] for identity in self._candidates(self.signature(text))]
+
+    def insert(self, text: str, key: Any = None) -> NoReturn:
+        """
+        插入text
+        :param text:
+        :param key: query返回的标识，默认为text本身
+        """
+        self._insert(self.signature(text), text if key is None else key)
+
+    def _insert(self, signature: Union[np.ndarray, int], key: Any) -> NoReturn:
+        identity = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        for table, band_key in zip(self.tables, self._band_keys(signature)):
+            table[band_key].append(identity)
+
+    def _query(self, signature: Union[np.ndarray, int], threshold: float) -> List[tuple]:
+        matches = []
+        for identity in self._candidates(signature):
+            score = self.similarity(signature, self.signatures[identity])
+            if score >= threshold:
+                matches.append((self.keys[identity], score))
+        matches.sort(key=lambda match: -match[1])
+        return matches
+
+    def query(self, text: str, threshold: float = None) -> List[tuple]:
+        """
+        查找和text近似重复的已插入文本
+        :param text:
+        :param threshold: 默认为创建时的threshold
+        :return: [(key, 估计的相似度)]，按相似度从高到低排序
+        >>> near = NearDuplication(threshold=0.5)
+        >>> near.insert('今天天气很好')
+        >>> near.insert('浪费粮食')
+        >>> [key for key, score in near.query('今天天气很好啊')]
+        ['今天天气很好']
+        """
+        return self._query(self.signature(text), self.threshold if threshold is None else threshold)
+
+    def is_duplication(self, text: str, update: bool = True) -> bool:
+        """
+        判断text是否和已插入的文本近似重复，update时插入不重复的text
+        >>> near = NearDuplication(method='simhash', max_distance=3)
+        >>> near.is_duplication('今天天气很好，适合出去走走'), near.is_duplication('今天天气很好，适合出去走走')
+        (False, True)
+        """
+        signature = self.signature(text)
+        if self._query(signature, self.threshold):
+            return True
+        if update:
+            self._insert(signature, text)
+        return False
+
 
 if __name__ == '__main__':
     import doctest
@@ -20,7 +20,7 @@ import zipfile
 from typing import Any, List, Union, NoReturn, Set, Type, Iterator, Callable, Tuple
 from numpy import ndarray
 from aitool.basic_function.basic import split_dict
-from aitool.basic_function.deduplication import Deduplication
+from aitool.basic_function.deduplication import Deduplication, get_deduplication
 
 
 def is_writable(path):
@@ -291,11 +291,15 @@ def repeat(item: Any) -> Any:
     return item
 
 
+# 按行读取并去重时每批的行数，取得较小以便尽快输出第一行
+LINE_BATCH_SIZE = 1024
+
+
 def load_line(
         file: str,
         separator: Union[None, str] = None,
         max_split: int = -1,
-        deduplication: bool = False,
+        deduplication: Union[bool, str, Deduplication] = False,
         line_processor: Callable = repeat,
         open_method: str = 'open',
         limit: int = -1,
@@ -306,18 +310,19 @@ def load_line(
     :param separator: 用separator切分每行内容，None表示不做切分
     :param max_split: 控制separator的切分次数，-1表示不限制次数
     :param line_processor: 一个函数，对separator的结果做处理
-    :param deduplication: 若为True，将不输出重复的行
+    :param deduplication: 若为True，将不输出重复的行。超大文件可以用'compact'减少内存，或用'bloom'、'cuckoo'固定内存，也可以传入Deduplication指定容量和误判率
     :param open_method: 指定打开文件的方法
     :param limit: 仅读前limit行
     :return: 文件每行的内容
     """
-    cache = Deduplication()
+    cache = get_deduplication(deduplication)
 
     def inner_line_process(_file_iterator):
         count = 0
+        if cache is not None:
+            _file_iterator = cache.iter_unique(
+                _file_iterator, batch_size=LINE_BATCH_SIZE, limit=None if limit == -1 else limit)
         for line in _file_iterator:
-            if deduplication and cache.is_duplication(line):
-                continue
             item = line.rstrip('\n\r')
             if separator:
                 item = item.split(separator, max_split)
@@ -362,14 +367,15 @@ def load_lines(
         separator: Union[None, str] = None,
         separator_time: int = -1,
         form: str = None,
-        deduplication: bool = False,
+        deduplication: Union[bool, str, Deduplication] = False,
 ) -> Union[list, dict, set]:
     data = []
-    cache = Deduplication()
+    cache = get_deduplication(deduplication)
     with open(file, 'r', encoding='utf8') as fin:
-        for line in fin.readlines():
-            if deduplication and cache.is_duplication(line):
-                continue
+        lines = fin.readlines()
+        if cache is not None:
+            lines = cache.iter_unique(lines, batch_size=LINE_BATCH_SIZE)
+        for line in lines:
             item = line.rstrip('\n\r')
             if separator:
                 if separator_time == -1:
@@ -16,14 +16,408 @@
 共提供3种实现方式pool_map，pool_starmap，multi_map
 使用方法请参考：test_pool_map()，test_pool_starmap()，test_multi_map()
 """
+import asyncio
+import atexit
 import functools
+import inspect
+import math
+import os
+import signal
+import tempfile
+import threading
+import traceback
+import uuid
+import weakref
 from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from itertools import chain, count, islice
 from os import cpu_count
+from queue import Queue, Empty
 from random import random
 from time import sleep, time
-from typing import Iterator, Callable, NoReturn
+from typing import Iterator, Callable, NoReturn, Tuple, Any, List, Dict, Union
 
+import dill
 import multiprocess as mp
+import multiprocess.pool
+import numpy as np
+from multiprocess import shared_memory, resource_tracker
+
+from aitool.basic_function.retry import check_retry_args, need_retry, is_empty
+
+# chunksize='auto'时，在进程池里试运行的任务数上限和时长上限（秒）
+_CHUNK_SAMPLE_NUMBER = 16
+_CHUNK_SAMPLE_TIME = 0.01
+# chunksize='auto'时，期望每个任务块的运行时长（秒），需明显大于一次进程间通信的耗时
+_CHUNK_TARGET_TIME = 0.02
+# 任务总数未知时chunksize的上限
+_CHUNK_MAX_SIZE = 1024
+_DEFAULT_EXECUTORS_LOCK = threading.Lock()
+# 设置task_timeout后，父进程检查超时任务的时间间隔上下限（秒）
+_TASK_TIMEOUT_CHECK_MIN = 0.01
+_TASK_TIMEOUT_CHECK_MAX = 1.0
+# 子进程超时后由操作系统结束，父进程多等待一段时间再判定，避免误判刚好完成的任务
+_TASK_TIMEOUT_GRACE = 0.1
+# CancelToken.cancel()时放入queue，用于唤醒阻塞中的主进程
+_CANCELLED = object()
+
+
+def _call_with_start(function: Callable, on_start: Callable) -> Any:
+    on_start()
+    return function()
+
+
+async def _acall(function: Callable, on_start: Callable = None) -> Any:
+    """
+    在事件循环里运行function：协程函数直接await，普通函数放到事件循环的默认线程池里运行，避免阻塞事件循环
+    :param on_start: function真正开始运行时调用，普通函数在线程池分到线程之后才调用
+    """
+    if asyncio.iscoroutinefunction(function):
+        if on_start is not None:
+            on_start()
+        return await function()
+    if on_start is not None:
+        function = functools.partial(_call_with_start, function, on_start)
+    result = await asyncio.get_event_loop().run_in_executor(None, function)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class _AsyncioPool:
+    """
+    用后台线程里的事件循环实现Pool的apply_async、map、starmap、close、join、terminate接口，供backend='asyncio'使用。
+    同时运行的任务数不超过processes。
+    """
+    def __init__(
+            self,
+            processes: int = cpu_count(),
+            initializer: Callable = None,
+            initargs: tuple = (),
+            maxtasksperchild: int = None,
+    ):
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=processes, initializer=initializer, initargs=initargs)
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._semaphore = self._submit(self._make_semaphore(processes)).result()
+        self._futures = weakref.WeakSet()
+
+    @staticmethod
+    async def _make_semaphore(processes: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(processes)
+
+    def _submit(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    async def _run(self, func: Callable, args: tuple, kwds: dict) -> Any:
+        async with self._semaphore:
+            return await _acall(functools.partial(func, *args, **kwds))
+
+    def apply_async(
+            self,
+            func: Callable,
+            args: tuple = (),
+            kwds: dict = None,
+            callback: Callable = None,
+            error_callback: Callable = None,
+    ) -> Future:
+        future = self._submit(self._run(func, args, kwds or {}))
+        self._futures.add(future)
+
+        def _done(_future: Future) -> NoReturn:
+            if _future.cancelled():
+                return
+            if _future.exception() is not None:
+                if error_callback is not None:
+                    error_callback(_future.exception())
+            elif callback is not None:
+                callback(_future.result())
+        future.add_done_callback(_done)
+        return future
+
+    def map(self, func: Callable, iterable: Iterable, chunksize: int = None) -> List[Any]:
+        return self.starmap(func, ((item,) for item in iterable))
+
+    def starmap(self, func: Callable, iterable: Iterable, chunksize: int = None) -> List[Any]:
+        futures = [self.apply_async(func, tuple(args)) for args in iterable]
+        return [future.result() for future in futures]
+
+    def close(self) -> NoReturn:
+        pass
+
+    def join(self) -> NoReturn:
+        wait_futures(list(self._futures))
+        self.terminate()
+
+    async def _cancel_all(self) -> NoReturn:
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def terminate(self) -> NoReturn:
+        if self._loop.is_closed():
+            return
+        self._submit(self._cancel_all()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self) -> '_AsyncioPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> NoReturn:
+        self.terminate()
+
+
+def _make_pool(
+        backend: str = 'process',
+        processes: int = cpu_count(),
+        initializer: Callable = None,
+        initargs: tuple = (),
+        maxtasksperchild: int = None,
+):
+    """
+    依据backend创建进程池、线程池或事件循环，三者接口一致
+    :param backend: 'process'表示多进程，'thread'表示多线程，'asyncio'表示事件循环（普通函数会放到线程池里运行）
+    """
+    if backend == 'process':
+        return mp.Pool(
+            processes=processes,
+            initializer=initializer,
+            initargs=initargs,
+            maxtasksperchild=maxtasksperchild,
+        )
+    if backend == 'thread':
+        return mp.pool.ThreadPool(processes=processes, initializer=initializer, initargs=initargs)
+    if backend == 'asyncio':
+        return _AsyncioPool(processes=processes, initializer=initializer, initargs=initargs)
+    raise ValueError('backend should be one of \'process\', \'thread\', \'asyncio\'')
+
+
+class PoolExecutor:
+    """
+    进程内常驻、可复用的进程池，供pool_map、pool_starmap、multi、multi_map通过executor参数共享。
+    backend为'thread'或'asyncio'时是常驻的线程池或事件循环。
+    * 懒启动：首次使用时才创建子进程，也可以用start()提前启动，让initializer（例如加载jieba词典）提前在后台执行
+    * 子进程在多次调用之间保留，fork和initializer的开销只付一次
+    * 解释器退出时会自动关闭所有PoolExecutor
+    * 注意：通过executor运行的multi在超时或提前停止消费时不会终止进程池，已提交的任务会在后台跑完
+
+    >>> executor = PoolExecutor(processes=2)
+    >>> list(pool_map(abs, [-1, -2], executor=executor))
+    [1, 2]
+    >>> list(multi_map(abs, [-3, -4], executor=executor))
+    [3, 4]
+    >>> executor.shutdown()
+    """
+    def __init__(
+            self,
+            processes: int = cpu_count(),
+            initializer: Callable = None,
+            initargs: tuple = (),
+            maxtasksperchild: int = None,
+            lazy: bool = True,
+            backend: str = 'process',
+    ):
+        """
+        :param processes: 进程数量
+        :param initializer: 每个子进程启动时执行的初始化函数
+        :param initargs: initializer的参数
+        :param maxtasksperchild: 每个子进程最多执行的任务数，超过后会被替换
+        :param lazy: 为False时立即启动进程池
+        :param backend: 'process'、'thread'或'asyncio'，详见multi
+        """
+        if processes < 1:
+            raise ValueError('processes should bigger than 0')
+        if backend not in ('process', 'thread', 'asyncio'):
+            raise ValueError('backend should be one of \'process\', \'thread\', \'asyncio\'')
+        self.processes = processes
+        self.backend = backend
+        self.initializer = initializer
+        self.initargs = initargs
+        self.maxtasksperchild = maxtasksperchild
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _EXECUTORS.add(self)
+        if not lazy:
+            self.start()
+
+    @property
+    def pool(self):
+        # fork出的子进程里不能使用父进程的进程池，需要重新创建
+        if self._pool is None or self._pid != os.getpid():
+            self.start()
+        return self._pool
+
+    def start(self) -> NoReturn:
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                return
+            self._pool = _make_pool(
+                backend=self.backend,
+                processes=self.processes,
+                initializer=self.initializer,
+                initargs=self.initargs,
+                maxtasksperchild=self.maxtasksperchild,
+            )
+            self._pid = os.getpid()
+
+    def shutdown(self, wait: bool = True) -> NoReturn:
+        """
+        :param wait: 为True时等待已提交的任务运行完，否则立即终止子进程
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = None
+                return
+            if wait:
+                self._pool.close()
+                self._pool.join()
+            else:
+                self._pool.terminate()
+            self._pool = None
+
+    def __enter__(self) -> 'PoolExecutor':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> NoReturn:
+        self.shutdown()
+
+
+_EXECUTORS = weakref.WeakSet()
+_DEFAULT_EXECUTORS = dict()
+
+
+def get_executor(
+        processes: int = cpu_count(),
+        initializer: Callable = None,
+        initargs: tuple = (),
+        maxtasksperchild: int = None,
+        backend: str = 'process',
+) -> PoolExecutor:
+    """
+    获取进程内共享的PoolExecutor，相同参数多次调用返回同一个对象
+    >>> get_executor(processes=2) is get_executor(processes=2)
+    True
+    """
+    key = (processes, initializer, initargs, maxtasksperchild, backend)
+    with _DEFAULT_EXECUTORS_LOCK:
+        if key not in _DEFAULT_EXECUTORS:
+            _DEFAULT_EXECUTORS[key] = PoolExecutor(
+                processes=processes,
+                initializer=initializer,
+                initargs=initargs,
+                maxtasksperchild=maxtasksperchild,
+                backend=backend,
+            )
+        return _DEFAULT_EXECUTORS[key]
+
+
+@atexit.register
+def _shutdown_executors() -> NoReturn:
+    for executor in list(_EXECUTORS):
+        executor.shutdown(wait=False)
+
+
+class SharedObject:
+    """
+    share()返回的轻量句柄，pickle后只有几十个字节，可以作为参数或闭包变量传给pool_map、multi_map等，
+    在子进程里用get()取回原对象，避免把大对象（词向量dict、KG对象、大数组）pickle进每个任务。
+    * numpy数组放在共享内存里，子进程里get()得到的是零拷贝、只读的视图
+    * 其他对象登记在本模块的全局变量里，子进程fork时直接继承，
+      因此需要在进程池启动前调用share()（PoolExecutor默认懒启动，首次使用时才fork）
+    """
+    def __init__(self, key: str, shm_name: str = None, shape: tuple = None, dtype: str = None):
+        self.key = key
+        self.shm_name = shm_name
+        self.shape = shape
+        self.dtype = dtype
+        self._value = None
+        self._shm = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_value'] = None
+        state['_shm'] = None
+        return state
+
+    def get(self) -> Any:
+        if self._value is not None:
+            return self._value
+        if self.shm_name is None:
+            if self.key not in _SHARED_OBJECTS:
+                raise KeyError(
+                    'shared object {} not found in process {}, '
+                    'please call share() before the pool is started'.format(self.key, os.getpid()))
+            self._value = _SHARED_OBJECTS[self.key]
+        else:
+            self._shm = shared_memory.SharedMemory(name=self.shm_name)
+            if self.key not in _SHARED_OBJECTS:
+                # 仅挂载不负责回收，避免子进程退出时resource_tracker误删共享内存
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+            array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+            array.flags.writeable = False
+            self._value = array
+        return self._value
+
+    def release(self) -> NoReturn:
+        """
+        在调用share()的进程里释放共享的对象
+        """
+        self._value = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+        owner = _SHARED_OBJECTS.pop(self.key, None)
+        if isinstance(owner, shared_memory.SharedMemory):
+            owner.close()
+            owner.unlink()
+
+    def __repr__(self) -> str:
+        return 'SharedObject({})'.format(self.key)
+
+
+_SHARED_OBJECTS = dict()
+
+
+def share(obj: Any) -> SharedObject:
+    """
+    登记一个只读的大对象，返回可廉价pickle的句柄SharedObject，在任务里用handle.get()取回对象
+    >>> handle = share({'word': [0.1, 0.2]})
+    >>> list(pool_map(lambda w, h=handle: h.get()[w], ['word']))
+    [[0.1, 0.2]]
+    >>> handle.release()
+    >>> vectors = share(np.arange(6, dtype='float32').reshape(2, 3))
+    >>> list(pool_map(lambda i, h=vectors: float(h.get()[i].sum()), [0, 1]))
+    [3.0, 12.0]
+    >>> vectors.release()
+    """
+    key = '{}_{}'.format(os.getpid(), uuid.uuid4().hex)
+    if isinstance(obj, np.ndarray):
+        shm = shared_memory.SharedMemory(create=True, size=max(obj.nbytes, 1))
+        array = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)
+        array[...] = obj
+        _SHARED_OBJECTS[key] = shm
+        return SharedObject(key, shm_name=shm.name, shape=obj.shape, dtype=obj.dtype.str)
+    _SHARED_OBJECTS[key] = obj
+    return SharedObject(key)
+
+
+@atexit.register
+def _release_shared_objects() -> NoReturn:
+    for key, value in list(_SHARED_OBJECTS.items()):
+        if isinstance(value, shared_memory.SharedMemory):
+            try:
+                value.close()
+                value.unlink()
+            except (FileNotFoundError, BufferError):
+                pass
+    _SHARED_OBJECTS.clear()
 
 
 def pool_map(
@@ -33,15 +427,38 @@ def pool_map(
         initializer=None,
         initargs=(),
         maxtasksperchild=None,
+        chunksize: Union[int, str, None] = None,
+        executor: PoolExecutor = None,
+        backend: str = 'process',
 ):
     # 基于pool.map实现
-    with mp.Pool(
+    # chunksize: 每次进程间通信打包的任务数。None为pool.map的默认值，'auto'表示依据实测的单任务耗时计算
+    # executor: 使用常驻的PoolExecutor，此时忽略processes、initializer、initargs、maxtasksperchild、backend
+    # backend: 'process'、'thread'或'asyncio'，详见multi
+    if executor is not None:
+        processes = executor.processes
+        backend = executor.backend
+    conditions = list(conditions)
+    if chunksize == 'auto' and backend != 'process':
+        # 线程池和事件循环没有进程间通信的开销，无需分块
+        chunksize = None
+
+    def _map(pool):
+        if chunksize == 'auto':
+            return _map_with_probe(pool, func, conditions, processes, star=False)
+        return pool.map(func, conditions, chunksize=chunksize)
+
+    if executor is not None:
+        yield from _map(executor.pool)
+        return
+    with _make_pool(
+            backend=backend,
             processes=processes,
             initializer=initializer,
             initargs=initargs,
             maxtasksperchild=maxtasksperchild,
     ) as p:
-        for result in p.map(func, conditions):
+        for result in _map(p):
             yield result
 
 
@@ -52,15 +469,38 @@ def pool_starmap(
         initializer=None,
         initargs=(),
         maxtasksperchild=None,
+        chunksize: Union[int, str, None] = None,
+        executor: PoolExecutor = None,
+        backend: str = 'process',
 ):
     # 基于pool.starmap实现
-    with mp.Pool(
+    # chunksize: 每次进程间通信打包的任务数。None为pool.starmap的默认值，'auto'表示依据实测的单任务耗时计算
+    # executor: 使用常驻的PoolExecutor，此时忽略processes、initializer、initargs、maxtasksperchild、backend
+    # backend: 'process'、'thread'或'asyncio'，详见multi
+    if executor is not None:
+        processes = executor.processes
+        backend = executor.backend
+    conditions = list(conditions)
+    if chunksize == 'auto' and backend != 'process':
+        # 线程池和事件循环没有进程间通信的开销，无需分块
+        chunksize = None
+
+    def _map(pool):
+        if chunksize == 'auto':
+            return _map_with_probe(pool, func, conditions, processes, star=True)
+        return pool.starmap(func, conditions, chunksize=chunksize)
+
+    if executor is not None:
+        yield from _map(executor.pool)
+        return
+    with _make_pool(
+            backend=backend,
             processes=processes,
             initializer=initializer,
             initargs=initargs,
             maxtasksperchild=maxtasksperchild,
     ) as p:
-        for result in p.starmap(func, conditions):
+        for result in _map(p):
             yield result
 
 
@@ -71,24 +511,74 @@ def multi_map(
         time_step: float = 0.01,
         ordered: bool = True,
         timeout: float = None,
+        max_inflight: int = None,
+        buffer_size: int = None,
+        spill: bool = False,
+        reorder_buffer: 'ReorderBuffer' = None,
+        chunksize: Union[int, str] = 1,
+        executor: PoolExecutor = None,
+        backend: str = 'process',
+        task_timeout: float = None,
+        cancel: 'CancelToken' = None,
+        cost: Union[Callable, Iterable[float]] = None,
+        errors: str = 'yield',
+        retries: int = 0,
+        retry_interval: float = 0,
+        retry_condition: str = 'no_error',
 ) -> Iterable:
     """
     基于一组参数并行计算func
     :param func: 函数
     :param conditions: 一组参数
     :param processes: 同时启动的进程数量上限，默认为cpu核数
-    :param time_step: 主进程每间隔time_step秒读取一次数据
+    :param time_step: 已不再使用，仅为兼容旧接口保留
     :param ordered: 是否按functions的顺序输出结果。ordered=True时，各function会等待排它前面的所有function输出后才输出。
     :param timeout: 最大运行时长，设置为None时表示不做时长限制
+    :param max_inflight: 流式模式。设置后不再预先展开conditions，而是随着结果被消费逐个读取，
+        同时在运行的任务数不超过max_inflight，适用于很大的或无限的迭代器。None表示一次性提交全部任务
+    :param buffer_size: ordered=True时，内存中暂存的乱序结果数上限，详见multi
+    :param spill: ordered=True时，超出buffer_size的乱序结果pickle到临时文件，详见multi
+    :param reorder_buffer: 自定义的ReorderBuffer，详见multi
+    :param chunksize: 每次进程间通信打包的任务数，'auto'表示依据实测的单任务耗时计算，详见multi
+    :param executor: 使用常驻的PoolExecutor，此时忽略processes和backend，详见multi
+    :param backend: 'process'、'thread'或'asyncio'，详见multi
+    :param task_timeout: 单个任务的最大运行时长（秒），超时的任务在输出里用TaskTimeout对象占位，详见multi
+    :param cancel: CancelToken，调用其cancel()后立即停止，详见multi
+    :param cost: 各任务的预估耗时，可以是一个以condition为输入的函数，也可以是和conditions等长的列表。
+        设置后耗时长的任务先提交，并自动分块以平衡各进程的负载，详见schedule
+    :param errors: 出错任务的处理方式，'yield'、'skip'或'raise'，详见multi
+    :param retries: 出错任务的重试次数，详见multi
+    :param retry_interval: 重试前等待的时长（秒）
+    :param retry_condition: 'no_error'或'no_empty'，同retry
     :return: functions里各个函数的返回结果
     """
-    functions = list(get_functions(func, conditions))
+    if cost is not None and callable(cost):
+        conditions = list(conditions)
+        cost = [cost(condition) for condition in conditions]
+    if max_inflight is None:
+        functions = list(get_functions(func, conditions))
+    else:
+        functions = get_functions(func, conditions)
     for result in multi(
             functions,
             processes=processes,
             time_step=time_step,
             ordered=ordered,
             timeout=timeout,
+            max_inflight=max_inflight,
+            buffer_size=buffer_size,
+            spill=spill,
+            reorder_buffer=reorder_buffer,
+            chunksize=chunksize,
+            executor=executor,
+            backend=backend,
+            task_timeout=task_timeout,
+            cancel=cancel,
+            cost=cost,
+            errors=errors,
+            retries=retries,
+            retry_interval=retry_interval,
+            retry_condition=retry_condition,
     ):
         yield result
 
@@ -150,68 +640,884 @@ def _return_2_queue(function: Callable, index: int, queue) -> NoReturn:
     queue.put((index, result))
 
 
+def _arm_kill_timer(seconds: float) -> Callable:
+    """
+    在子进程里设置定时器，超时后由操作系统直接结束本进程，卡在C扩展里不释放GIL也能结束。
+    进程池会自动补充新的子进程。
+    :param seconds: 超时时长（秒）
+    :return: 解除定时器的函数
+    """
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        return functools.partial(signal.setitimer, signal.ITIMER_REAL, 0)
+    timer = threading.Timer(seconds, os._exit, args=(1,))
+    timer.daemon = True
+    timer.start()
+    return timer.cancel
+
+
+def _call(function: Callable) -> Tuple[bool, Any]:
+    """
+    运行function并捕获异常，异常堆栈转为字符串以便传回父进程
+    :return: (True, 结果) 或 (False, (异常, 异常堆栈))
+    """
+    try:
+        return True, function()
+    except Exception as e:
+        return False, (e, traceback.format_exc())
+
+
+def _run_chunk(
+        functions: List[Callable],
+        index: int,
+        started: dict = None,
+        kill_after: float = None,
+        delay: float = 0,
+) -> Tuple[int, bool, List[Tuple[bool, Any]]]:
+    """
+    在子进程里依次执行一块function，并将块的序号和各function的结果一起返回给父进程。
+    块内某个function出错不影响其他function。
+    :param functions: 一块function
+    :param index: 块的序号
+    :param started: 用于向父进程登记开始运行的时刻，以便父进程判断是否超时
+    :param kill_after: 单个function的超时时长（秒），超时后结束本进程
+    :param delay: 开始运行前等待的时长（秒），用于重试的间隔
+    :return: (序号, 是否成功, [(是否成功, 结果或(异常, 异常堆栈)), ...])
+    """
+    if delay:
+        sleep(delay)
+    if started is not None:
+        started[index] = time()
+    results = []
+    for function in functions:
+        disarm = _arm_kill_timer(kill_after) if kill_after else None
+        try:
+            results.append(_call(function))
+        finally:
+            if disarm:
+                disarm()
+    if started is not None:
+        started.pop(index, None)
+    return index, True, results
+
+
+async def _arun_chunk(
+        functions: List[Callable],
+        index: int,
+        started: dict = None,
+        delay: float = 0,
+) -> Tuple[int, bool, List[Tuple[bool, Any]]]:
+    """
+    _run_chunk的协程版本，供backend='asyncio'使用
+    """
+    if delay:
+        await asyncio.sleep(delay)
+    results = []
+    spent = 0
+    for function in functions:
+        begin = None
+
+        def _on_start():
+            # 在function真正开始运行时才登记，并扣除块内已运行的时长，等待线程池的排队时间不计入超时
+            nonlocal begin
+            begin = time()
+            if started is not None:
+                started[index] = begin - spent
+
+        try:
+            results.append((True, await _acall(function, _on_start)))
+        except Exception as e:
+            results.append((False, (e, traceback.format_exc())))
+        if begin is not None:
+            spent += time() - begin
+    if started is not None:
+        started.pop(index, None)
+    return index, True, results
+
+
+def _put_error(queue: Queue, index: int, error: BaseException) -> NoReturn:
+    """
+    apply_async的error_callback，将出错信息也放入queue，保证每个任务块都有一条返回记录。
+    :param queue: 父进程内的队列
+    :param index: 块的序号
+    :param error: 子进程抛出的异常
+    :return:
+    """
+    queue.put((index, False, error))
+
+
+def _chunk(functions: Iterator[Callable], chunksize: int) -> Iterator[List[Callable]]:
+    """
+    将functions按chunksize个一组打包，不会预先展开functions
+    >>> list(_chunk(iter(range(5)), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    functions = iter(functions)
+    while True:
+        chunk = list(islice(functions, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _chunk_with_members(
+        functions: Iterator[Callable],
+        chunksize: int,
+        base: int = 0,
+) -> Iterator[Tuple[List[Callable], range]]:
+    """
+    同_chunk，同时给出块内各function的序号
+    >>> list(_chunk_with_members(iter('abcde'), 2, base=1))
+    [(['a', 'b'], range(1, 3)), (['c', 'd'], range(3, 5)), (['e'], range(5, 6))]
+    """
+    offset = base
+    for chunk in _chunk(functions, chunksize):
+        yield chunk, range(offset, offset + len(chunk))
+        offset += len(chunk)
+
+
+def schedule(costs: List[float], processes: int = cpu_count(), factor: int = 2) -> List[List[int]]:
+    """
+    依据各任务的预估耗时cost分块，适用于耗时很不均衡的任务，无需手动划分任务范围。
+    1. 按cost从大到小排序，耗时长的任务最先提交（LPT）
+    2. 依次切块，每块的cost之和不超过 剩余的总cost / (factor * processes)，每块至少1个任务，
+       因此开始时块较大或是单个大任务，越往后块越小
+    各块按顺序进入进程池共享的任务队列，空闲的进程立即领取剩下的块，相当于空闲进程从忙碌进程那里"偷"走了剩余的任务，
+    越往后块越小，使各进程几乎同时结束。
+    只有耗时长的任务排在输入的后面时才有明显收益：chunksize=1时空闲的进程本就会领取下一个任务，
+    若任务耗时相近或长任务已排在前面，总时长与chunksize=1相当（如test_multi_map_cost），对比见benchmark_schedule。
+    :param costs: 各任务的预估耗时，只需要相对大小准确
+    :param processes: 进程数量
+    :param factor: 越大则块越小，负载越均衡，但进程间通信次数越多
+    :return: 各块内的任务序号
+
+    >>> schedule([1, 8, 1, 1, 4, 1, 1, 1], processes=2, factor=1)
+    [[1], [4, 0], [2, 3], [5], [6], [7]]
+    """
+    order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    remaining = float(sum(costs))
+    chunks = []
+    chunk = []
+    chunk_cost = 0.0
+    limit = remaining / (factor * max(processes, 1))
+    for i in order:
+        if chunk and chunk_cost + costs[i] > limit:
+            chunks.append(chunk)
+            remaining -= chunk_cost
+            limit = remaining / (factor * max(processes, 1))
+            chunk = []
+            chunk_cost = 0.0
+        chunk.append(i)
+        chunk_cost += costs[i]
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _estimate_chunksize(cost: float, task_number: int = None, processes: int = cpu_count()) -> int:
+    """
+    依据单任务耗时计算chunksize，使每块的运行时长约为_CHUNK_TARGET_TIME秒，
+    同时保证每个进程至少能分到4块，避免尾部负载不均。
+    >>> _estimate_chunksize(0.0001, 100000, 4)
+    200
+    >>> _estimate_chunksize(1.0, 100000, 4)
+    1
+    >>> _estimate_chunksize(0.0000001, 1000, 4)
+    63
+    """
+    if cost <= 0:
+        chunksize = _CHUNK_MAX_SIZE
+    else:
+        chunksize = int(_CHUNK_TARGET_TIME / cost)
+    if task_number is not None:
+        chunksize = min(chunksize, math.ceil(task_number / (max(processes, 1) * 4)))
+    else:
+        chunksize = min(chunksize, _CHUNK_MAX_SIZE)
+    return max(chunksize, 1)
+
+
+def _run_probe(
+        functions: List[Callable],
+        kill_after: float = None,
+) -> Tuple[float, List[Tuple[bool, Any]]]:
+    """
+    在子进程里依次试运行functions，累计超过_CHUNK_SAMPLE_TIME后不再运行剩下的function
+    :param functions: 试运行的function
+    :param kill_after: 单个function的超时时长（秒），超时后结束本进程
+    :return: (实际运行的时长, [(是否成功, 结果或(异常, 异常堆栈)), ...])
+    """
+    results = []
+    begin = time()
+    for function in functions:
+        disarm = _arm_kill_timer(kill_after) if kill_after else None
+        try:
+            results.append(_call(function))
+        finally:
+            if disarm:
+                disarm()
+        if time() - begin >= _CHUNK_SAMPLE_TIME:
+            break
+    return time() - begin, results
+
+
+def _probe_chunksize(
+        pool,
+        functions: Iterator[Callable],
+        task_number: int = None,
+        processes: int = cpu_count(),
+        kill_after: float = None,
+        wait: float = None,
+) -> Tuple[List[Tuple[bool, Any]], int, List[Callable], Iterator[Callable]]:
+    """
+    把functions的前几个任务作为一块送到pool里试运行，测得单任务耗时后计算chunksize。
+    试运行和其他任务一样在子进程里执行，initializer已经运行过，也不会阻塞主进程里的其他操作。
+    试运行的结果会直接返回，不会被重复计算。
+    :param pool: 进程池
+    :param functions: 函数的迭代器，只会消费试运行的部分
+    :param task_number: 任务总数，未知时为None
+    :param processes: 进程数量
+    :param kill_after: 单个function的超时时长（秒），超时后结束运行试运行的子进程
+    :param wait: 等待试运行结果的时长上限（秒），超时后不分块，试运行的function全部重新提交。None表示一直等待
+    :return: ([(是否成功, 结果或(异常, 异常堆栈)), ...], chunksize, 已试运行的function, 剩下的function)
+    """
+    sample = list(islice(functions, _CHUNK_SAMPLE_NUMBER))
+    if not sample:
+        return [], 1, [], functions
+    try:
+        elapsed, items = pool.apply_async(_run_probe, args=(sample, kill_after)).get(timeout=wait)
+    except mp.TimeoutError:
+        print('Warning: chunksize probe timeout, use chunksize=1')
+        return [], 1, [], chain(sample, functions)
+    except Exception as e:
+        # 整块出错，例如function无法pickle，试运行的每个function都视为出错
+        return [(False, (e, traceback.format_exc()))] * len(sample), 1, sample, functions
+    sampled = sample[:len(items)]
+    if task_number is not None:
+        task_number = max(task_number - len(sampled), 0)
+    chunksize = _estimate_chunksize(elapsed / len(sampled), task_number, processes)
+    return items, chunksize, sampled, chain(sample[len(items):], functions)
+
+
+def _map_with_probe(
+        pool,
+        func: Callable,
+        conditions: List,
+        processes: int,
+        star: bool = False,
+) -> Iterator[Any]:
+    """
+    pool_map和pool_starmap在chunksize='auto'时使用：先用_probe_chunksize在pool里试运行前几个任务，再分块map剩下的任务
+    """
+    sample = (functools.partial(func, *condition) if star else functools.partial(func, condition)
+              for condition in conditions)
+    items, chunksize, sampled, _ = _probe_chunksize(pool, sample, len(conditions), processes)
+    for success, result in items:
+        if not success:
+            raise result[0]
+        yield result
+    mapper = pool.starmap if star else pool.map
+    yield from mapper(func, conditions[len(sampled):], chunksize=chunksize)
+
+
+class TaskError:
+    """
+    multi里出错的function在输出结果里的占位对象，使输出的结果数和输入的function数一致
+    * index: function的序号
+    * exception: 抛出的异常
+    * traceback: 异常堆栈（字符串，子进程里的堆栈也能保留）
+    * attempts: 总共运行的次数
+    """
+    def __init__(self, index: int, exception: BaseException, traceback: str = '', attempts: int = 1):
+        self.index = index
+        self.exception = exception
+        self.traceback = traceback
+        self.attempts = attempts
+
+    def __repr__(self) -> str:
+        return 'TaskError({}, {!r})'.format(self.index, self.exception)
+
+
+class TaskTimeout(TimeoutError):
+    """
+    multi设置task_timeout后，超时的任务在输出结果里的占位对象（不会被抛出）
+    """
+    def __init__(self, index: int):
+        super(TaskTimeout, self).__init__('task {} timeout'.format(index))
+        self.index = index
+
+
+class CancelToken:
+    """
+    用于中止multi剩余的任务。调用cancel()后multi立即停止提交和输出，不等待进程池终止。
+    可以在消费结果的循环里调用，也可以在其他线程里调用。
+    >>> token = CancelToken()
+    >>> token.cancelled
+    False
+    >>> token.cancel()
+    >>> token.cancelled
+    True
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> NoReturn:
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable) -> NoReturn:
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable) -> NoReturn:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class ReorderBuffer:
+    """
+    multi(ordered=True)使用的重排缓冲区，暂存先于队首返回的结果。
+    * capacity: 内存中最多暂存的结果数，None表示不限制
+    * spill=False时，暂存的结果数加上还在运行的任务数达到capacity后，multi会暂停提交新任务，直到队首的结果返回
+    * spill=True时，超出capacity的结果按序号pickle到临时文件，不阻塞提交
+    * high_water/spill_high_water记录内存/临时文件中同时暂存的结果数的峰值，用于调整capacity
+
+    >>> buffer = ReorderBuffer(capacity=1, spill=True)
+    >>> buffer.put(2, 'c')
+    >>> buffer.put(1, 'b')
+    >>> list(buffer.pop_ready())
+    []
+    >>> buffer.put(0, 'a')
+    >>> list(buffer.pop_ready())
+    ['a', 'b', 'c']
+    >>> buffer.high_water, buffer.spill_high_water, buffer.spilled
+    (2, 1, 1)
+    >>> buffer.close()
+    """
+    def __init__(self, capacity: int = None, spill: bool = False):
+        if capacity is not None and capacity < 1:
+            raise ValueError('capacity should bigger than 0')
+        self.capacity = capacity
+        self.spill = spill
+        self.head = 0
+        self.memory = dict()
+        # 序号 -> (在临时文件里的偏移量, 长度)
+        self.disk = dict()
+        self.file = None
+        self.high_water = 0
+        self.spill_high_water = 0
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return len(self.memory) + len(self.disk)
+
+    def full(self, pending: int = 0) -> bool:
+        """
+        :param pending: 已提交但还未返回的任务数，它们的结果都可能进入缓冲区
+        :return: 是否应暂停提交新任务
+        """
+        if self.spill or self.capacity is None:
+            return False
+        return len(self.memory) + pending >= self.capacity
+
+    def put(self, index: int, value: Any) -> NoReturn:
+        if index != self.head and self.capacity is not None and len(self.memory) >= self.capacity and self.spill:
+            self._dump(index, value)
+            return
+        self.memory[index] = value
+        self.high_water = max(self.high_water, len(self.memory))
+
+    def pop_ready(self) -> Iterator[Any]:
+        # 输出从队首开始的所有连续结果
+        while True:
+            if self.head in self.memory:
+                value = self.memory.pop(self.head)
+            elif self.head in self.disk:
+                value = self._load(self.head)
+            else:
+                break
+            self.head += 1
+            yield value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self.memory),
+            'high_water': self.high_water,
+            'spill_size': len(self.disk),
+            'spill_high_water': self.spill_high_water,
+            'spilled': self.spilled,
+        }
+
+    def close(self) -> NoReturn:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.disk = dict()
+
+    def _dump(self, index: int, value: Any) -> NoReturn:
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+        data = dill.dumps(value)
+        self.file.seek(0, os.SEEK_END)
+        self.disk[index] = (self.file.tell(), len(data))
+        self.file.write(data)
+        self.spilled += 1
+        self.spill_high_water = max(self.spill_high_water, len(self.disk))
+
+    def _load(self, index: int) -> Any:
+        offset, length = self.disk.pop(index)
+        self.file.seek(offset)
+        value = dill.loads(self.file.read(length))
+        if not self.disk:
+            # 临时文件里的结果都已取出，回收磁盘空间
+            self.file.seek(0)
+            self.file.truncate()
+        return value
+
+
 def multi(
         functions: Iterator[Callable],
         processes: int = cpu_count(),
         time_step: float = 0.01,
         ordered: bool = True,
         timeout: float = None,
+        max_inflight: int = None,
+        buffer_size: int = None,
+        spill: bool = False,
+        reorder_buffer: ReorderBuffer = None,
+        chunksize: Union[int, str] = 1,
+        executor: PoolExecutor = None,
+        backend: str = 'process',
+        task_timeout: float = None,
+        cancel: CancelToken = None,
+        cost: Union[Callable, Iterable[float]] = None,
+        errors: str = 'yield',
+        retries: int = 0,
+        retry_interval: float = 0,
+        retry_condition: str = 'no_error',
 ) -> Iterable:
     """
     对输入的多个函数进行多进程并发运行，对输出的
+    每个任务完成后会通过apply_async的回调立即放入父进程内的队列，主进程阻塞等待结果而不是轮询。
+    通过对比已提交和已完成的任务数判断是否全部运行完毕。
     :param functions: 函数的列表或迭代器
     :param processes: 同时启动的进程数量上限，默认为cpu核数
-    :param time_step: 主进程每间隔time_step秒读取一次数据
+    :param time_step: 已不再使用，仅为兼容旧接口保留
     :param ordered: 是否按functions的顺序输出结果。ordered=True时，各function会等待排它前面的所有function输出后才输出。
     :param timeout: 最大运行时长，设置为None时表示不做时长限制
+    :param max_inflight: 已提交但未返回的任务数上限，达到上限后等结果被消费再从functions里取新的任务。None表示不限制
+    :param buffer_size: ordered=True时，内存中暂存的乱序结果数上限，达到上限后暂停提交新任务直到队首结果返回。
+        为None时取max_inflight*chunksize，保证流式模式下内存占用和输入规模无关
+    :param spill: ordered=True时，超出buffer_size的乱序结果pickle到临时文件而不是暂停提交
+    :param reorder_buffer: 自定义的ReorderBuffer，设置后忽略buffer_size和spill，可在运行后读取其high_water等统计值
+    :param chunksize: 每次进程间通信打包的function数，适用于大量耗时极短的function。
+        'auto'表示先把前几个function作为一块送到进程池里试运行，依据实测耗时计算chunksize。
+        试运行等待的时长不超过task_timeout和timeout，超时后不分块，试运行的function会重新提交。
+        chunksize>1时，max_inflight按块计数
+    :param executor: 使用常驻的PoolExecutor而不是新建进程池，此时忽略processes和backend。
+        运行结束后不会关闭进程池；超时或提前停止消费时，已提交的任务会在后台跑完
+    :param backend: 'process'表示多进程；'thread'表示多线程，适用于I/O密集的函数，且无需pickle；
+        'asyncio'表示在后台的事件循环里运行，协程函数直接await，普通函数放到线程池里运行。
+        后两者的processes表示并发数，chunksize='auto'时不分块，超时后已运行的任务无法被强制终止
+    :param task_timeout: 单个function的最大运行时长（秒）。超时的function在输出里用TaskTimeout对象占位。
+        backend='process'时卡住的子进程会被结束并由进程池补充新的子进程；'asyncio'时会取消该任务；
+        'thread'时线程无法被结束，只是不再等待其结果，'asyncio'里的普通函数同理，二者仍会占用并发数。chunksize>1时块内任一function超时，整块都输出TaskTimeout
+    :param cancel: CancelToken，调用其cancel()后立即停止提交和输出，不等待进程池终止
+    :param cost: 各function的预估耗时，可以是一个以function为输入的函数，也可以是和functions等长的列表。
+        设置后会预先展开functions，按schedule()的方式从耗时长的开始分块提交，忽略chunksize
+    :param errors: 出错的function的处理方式。'yield'表示在输出里用TaskError对象占位，保证输出数和输入数一致；
+        'skip'表示打印错误后跳过；'raise'表示停止运行并抛出该异常
+    :param retries: 出错的function的重试次数。重试的function会重新提交到进程池，不影响其他function
+    :param retry_interval: 重试前等待的时长（秒），在子进程里等待
+    :param retry_condition: 'no_error'表示出错时重试，'no_empty'表示返回值为空时重试，同retry。超时的function不会重试
     :return: functions里各个函数的返回结果
     """
+    if executor is not None:
+        processes = executor.processes
+        backend = executor.backend
     if processes < 1:
         raise ValueError('processes should bigger than 0')
+    if max_inflight is not None and max_inflight < 1:
+        raise ValueError('max_inflight should bigger than 0')
+    if chunksize != 'auto' and chunksize < 1:
+        raise ValueError('chunksize should bigger than 0 or be \'auto\'')
+    if errors not in ('yield', 'skip', 'raise'):
+        raise ValueError('errors should be \'yield\', \'skip\' or \'raise\'')
+    retries, retry_interval, retry_condition = check_retry_args(retries, retry_interval, retry_condition)
     begin_time = time()
 
-    def print_error(value):
-        print("线程池出错: ", value)
+    if cost is not None:
+        # 依据cost调度，chunksize由schedule决定
+        functions = list(functions)
+        if callable(cost):
+            costs = [cost(function) for function in functions]
+        else:
+            costs = list(cost)
+            if len(costs) != len(functions):
+                raise ValueError('cost should have the same length as functions')
+        chunks = [([functions[i] for i in members], members) for members in schedule(costs, processes)]
+        chunksize = max((len(members) for _, members in chunks), default=1)
+    if chunksize == 'auto' and backend != 'process':
+        # 线程池和事件循环没有进程间通信的开销，无需分块
+        chunksize = 1
+
+    # 回调函数运行在父进程的结果处理线程里，所以用线程安全的queue.Queue即可，无需Manager
+    queue = Queue()
+    pool = executor.pool if executor is not None else _make_pool(backend=backend, processes=processes)
+    sample_items = []
+    sampled = []
+    if chunksize == 'auto':
+        task_number = len(functions) if hasattr(functions, '__len__') else None
+        # 等待试运行的时长不超过task_timeout和timeout。试运行期间第一个function就开始运行，之后最多再运行一个function
+        wait = None
+        if task_timeout is not None:
+            wait = task_timeout + _CHUNK_SAMPLE_TIME + _TASK_TIMEOUT_GRACE
+        if timeout is not None:
+            wait = timeout if wait is None else min(wait, timeout)
+        try:
+            sample_items, chunksize, sampled, functions = _probe_chunksize(
+                pool, iter(functions), task_number, processes, kill_after=task_timeout, wait=wait)
+        except BaseException:
+            if executor is None:
+                pool.terminate()
+            raise
+    if cost is None:
+        chunks = _chunk_with_members(functions, chunksize, len(sampled))
+    chunks = iter(chunks)
+    run_chunk = _arun_chunk if backend == 'asyncio' else _run_chunk
+    task_ids = count()
+    exhausted = False
+    submitted = 0
+    finished = 0
+    # 已提交未返回的块: 序号 -> (块内各function在functions里的序号, 块内的function, 第几次运行)
+    pending = dict()
+    pending_functions = 0
+
+    # task_timeout时，由子进程登记开始运行的时刻
+    manager = None
+    started = None
+    run_kwargs = dict()
+    futures = dict()
+    if task_timeout is not None:
+        if backend == 'process':
+            manager = mp.Manager()
+            started = manager.dict()
+            run_kwargs['kill_after'] = task_timeout
+        else:
+            started = dict()
+        run_kwargs['started'] = started
+        check_interval = min(max(task_timeout / 4, _TASK_TIMEOUT_CHECK_MIN), _TASK_TIMEOUT_CHECK_MAX)
+
+    def _wake() -> NoReturn:
+        queue.put(_CANCELLED)
+    if cancel is not None:
+        cancel.add_callback(_wake)
+
+    # ordered == True时用于控制输出顺序，以function为单位暂存。max_inflight按块计数，换算为function数
+    if reorder_buffer is None:
+        if buffer_size is None and max_inflight is not None:
+            buffer_size = max_inflight * chunksize
+        reorder_buffer = ReorderBuffer(capacity=buffer_size, spill=spill)
+
+    def _submit(chunk: List[Callable], members: List[int], attempt: int = 1, delay: float = 0) -> NoReturn:
+        nonlocal submitted, pending_functions
+        index = next(task_ids)
+        pending[index] = (members, chunk, attempt)
+        pending_functions += len(members)
+        futures[index] = pool.apply_async(
+            run_chunk,
+            args=(chunk, index,),
+            kwds=dict(run_kwargs, delay=delay) if delay else run_kwargs,
+            callback=queue.put,
+            error_callback=functools.partial(_put_error, queue, index),
+        )
+        submitted += 1
+
+    def _dispatch() -> NoReturn:
+        nonlocal exhausted
+        while not exhausted:
+            if cancel is not None and cancel.cancelled:
+                return
+            if max_inflight is not None and submitted - finished >= max_inflight:
+                return
+            # 没有在运行的任务时不能暂停，否则队首的任务永远不会被提交
+            if ordered and pending_functions and reorder_buffer.full(pending=pending_functions):
+                return
+            try:
+                chunk, members = next(chunks)
+            except StopIteration:
+                exhausted = True
+                if executor is None and not retries:
+                    pool.close()
+                return
+            _submit(chunk, members)
+
+    def _accept(
+            members: List[int],
+            chunk: List[Callable],
+            attempt: int,
+            results: List[Tuple[bool, Any]],
+    ) -> List[Tuple[int, Any]]:
+        # 需要重试的function重新提交，其余的转为输出的结果，出错的用TaskError占位
+        ready = []
+        retry_members = []
+        retry_chunk = []
+        for member, function, (_success, _result) in zip(members, chunk, results):
+            # 只有按返回值是否为空重试时才判断返回值，返回numpy数组等对象时不会出错
+            _empty = retry_condition == 'no_empty' and _success and is_empty(_result)
+            if attempt <= retries and need_retry(retry_condition, not _success, _empty):
+                retry_members.append(member)
+                retry_chunk.append(function)
+            elif _success:
+                ready.append((member, _result))
+            else:
+                ready.append((member, TaskError(member, _result[0], _result[1], attempt)))
+        if retry_members and not (cancel is not None and cancel.cancelled):
+            print('Warning: retry {} time:'.format(attempt), retry_members)
+            _submit(retry_chunk, retry_members, attempt + 1, retry_interval)
+        return ready
+
+    def _expired() -> List[Tuple[int, Any]]:
+        # 找出超时的块，用TaskTimeout占位
+        nonlocal finished, pending_functions
+        now = time()
+        limit = task_timeout + (_TASK_TIMEOUT_GRACE if backend == 'process' else 0)
+        ready = []
+        for _index, _begin in list(started.items()):
+            if _index not in pending:
+                continue
+            _members = pending[_index][0]
+            if now - _begin > limit * len(_members):
+                pending.pop(_index)
+                started.pop(_index, None)
+                finished += 1
+                pending_functions -= len(_members)
+                if backend == 'asyncio':
+                    futures[_index].cancel()
+                print('Warning: task timeout', list(_members))
+                ready.extend((member, TaskTimeout(member)) for member in _members)
+        return ready
+
+    def _output(_items: Iterable[Any]) -> Iterator[Any]:
+        for _item in _items:
+            if cancel is not None and cancel.cancelled:
+                return
+            if isinstance(_item, TaskError):
+                if errors == 'raise':
+                    raise _item.exception
+                if errors == 'skip':
+                    print("线程池出错: ", _item.exception)
+                    continue
+            yield _item
+
+    def _emit(ready: List[Tuple[int, Any]]) -> Iterator[Any]:
+        if not ordered:
+            # 先补充任务再输出，避免消费者处理结果时子进程空闲
+            _dispatch()
+            yield from _output(_item for _, _item in ready)
+        else:
+            for member, _item in ready:
+                reorder_buffer.put(member, _item)
+            yield from _output(reorder_buffer.pop_ready())
+
+    try:
+        # 试运行的结果和其他结果一样处理，出错时也可以重试
+        yield from _emit(_accept(list(range(len(sampled))), sampled, 1, sample_items))
+        _dispatch()
+        while finished < submitted:
+            if cancel is not None and cancel.cancelled:
+                break
+            wait = None
+            if timeout is not None:
+                wait = begin_time + timeout - time()
+                if wait <= 0:
+                    print('Warning: pool timeout')
+                    break
+            if task_timeout is not None:
+                wait = check_interval if wait is None else min(wait, check_interval)
+            ready = []
+            try:
+                message = queue.get(timeout=wait)
+                if message is _CANCELLED:
+                    break
+                _index, _success, _results = message
+                futures.pop(_index, None)
+                # 已被判定为超时的块，忽略其迟到的结果
+                _pending = pending.pop(_index, None)
+                if _pending is not None:
+                    _members, _chunk, _attempt = _pending
+                    finished += 1
+                    pending_functions -= len(_members)
+                    if not _success:
+                        # 整块出错，例如function无法pickle，块内每个function都视为出错
+                        _trace = ''.join(traceback.format_exception(type(_results), _results, _results.__traceback__))
+                        _results = [(False, (_results, _trace))] * len(_members)
+                    ready.extend(_accept(_members, _chunk, _attempt, _results))
+            except Empty:
+                if task_timeout is None:
+                    print('Warning: pool timeout')
+                    break
+            if task_timeout is not None:
+                ready.extend(_expired())
+            yield from _emit(ready)
+            _dispatch()
+    finally:
+        if cancel is not None:
+            cancel.remove_callback(_wake)
+        if executor is None:
+            if cancel is not None and cancel.cancelled:
+                # 不等待进程池终止
+                threading.Thread(target=pool.terminate, daemon=True).start()
+            else:
+                pool.terminate()
+        if manager is not None:
+            manager.shutdown()
+        reorder_buffer.close()
+
 
+async def amulti_map(
+        func: Callable,
+        conditions: Iterable,
+        processes: int = cpu_count(),
+        ordered: bool = True,
+        timeout: float = None,
+        max_inflight: int = None,
+        errors: str = 'yield',
+):
+    """
+    multi_map的异步生成器版本，在当前事件循环里运行，适用于在协程中并发调用chatgpt、download_file等I/O密集的函数。
+    协程函数直接await，普通函数放到事件循环的默认线程池里运行。conditions会被逐个读取，不会预先展开。
+    :param func: 函数，可以是协程函数
+    :param conditions: 一组参数，解析方式同get_functions
+    :param processes: 并发数
+    :param ordered: 是否按conditions的顺序输出结果
+    :param timeout: 最大运行时长，设置为None时表示不做时长限制
+    :param max_inflight: 同时运行和等待输出的任务数上限，None时取processes
+    :param errors: 出错任务的处理方式，'yield'、'skip'或'raise'，详见multi
+    :return: 各个参数对应的返回结果
+
+    >>> async def _double(x):
+    ...     return x * 2
+    >>> async def _collect():
+    ...     return [result async for result in amulti_map(_double, range(5), processes=2)]
+    >>> asyncio.run(_collect())
+    [0, 2, 4, 6, 8]
+    """
+    if processes < 1:
+        raise ValueError('processes should bigger than 0')
+    if errors not in ('yield', 'skip', 'raise'):
+        raise ValueError('errors should be \'yield\', \'skip\' or \'raise\'')
+    if max_inflight is None:
+        max_inflight = processes
+    begin_time = time()
+    tasks = enumerate(get_functions(func, conditions))
+    exhausted = False
+    running = dict()
+    reorder_buffer = ReorderBuffer(capacity=max_inflight)
+    semaphore = asyncio.Semaphore(processes)
+
+    async def _run(function: Callable) -> Any:
+        async with semaphore:
+            return await _acall(function)
+
+    def _dispatch() -> NoReturn:
+        nonlocal exhausted
+        while not exhausted and len(running) < max_inflight:
+            if ordered and reorder_buffer.full(pending=len(running)):
+                return
+            try:
+                index, function = next(tasks)
+            except StopIteration:
+                exhausted = True
+                return
+            running[asyncio.ensure_future(_run(function))] = index
+
+    try:
+        _dispatch()
+        while running:
+            wait = None
+            if timeout is not None:
+                wait = begin_time + timeout - time()
+                if wait <= 0:
+                    print('Warning: pool timeout')
+                    break
+            done, _ = await asyncio.wait(list(running), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                print('Warning: pool timeout')
+                break
+            for task in done:
+                _index = running.pop(task)
+                error = task.exception()
+                if error is not None:
+                    if errors == 'raise':
+                        raise error
+                    if errors == 'skip':
+                        print("线程池出错: ", error)
+                        _results = []
+                    else:
+                        _trace = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+                        _results = [TaskError(_index, error, _trace)]
+                else:
+                    _results = [task.result()]
+                if not ordered:
+                    for _result in _results:
+                        yield _result
+                else:
+                    reorder_buffer.put(_index, _results)
+                    for _results in reorder_buffer.pop_ready():
+                        for _result in _results:
+                            yield _result
+            _dispatch()
+    finally:
+        for task in running:
+            task.cancel()
+        reorder_buffer.close()
+
+
+def _multi_polling(
+        functions: Iterator[Callable],
+        processes: int = cpu_count(),
+        time_step: float = 0.01,
+        ordered: bool = True,
+        timeout: float = None,
+) -> Iterable:
+    """
+    multi的旧实现：每隔time_step秒轮询一次Manager().Queue()，并通过扫描pool._pool的exitcode判断是否结束。
+    仅保留用于benchmark_multi的对比，不建议使用。
+    """
+    begin_time = time()
     queue = mp.Manager().Queue()
     pool = mp.Pool(processes=processes)
     for index, function in enumerate(functions):
-        pool.apply_async(_return_2_queue, args=(function, index, queue,), error_callback=print_error)
+        pool.apply_async(_return_2_queue, args=(function, index, queue,))
     pool.close()
 
-    # ordered == True时用于控制输出顺序
     ordered_results = dict()
     ordered_requirement = 0
-
-    # 每time_step秒进行一次巡察
     while True:
-        # TODO
-        # 有更好的方式监控queue并及时返回结果吗？
-        # 目前用的yield很蠢，如果不及时消费，所有子进程都会阻塞
-        # 想设计一个负责取值的子进程持续监控queue并传值给主进程，
-        # 但是主进程的消费和取值的子进程好像可能导致读写冲突，不知道加个锁是否能解决这个问题，
-        # 以及不确定这样设计后yield是否依然会阻塞所有子进程
         sleep(time_step)
         while not queue.empty():
             _index, _result = queue.get(False)
             if not ordered:
                 yield _result
             else:
-                # TODO
-                # ordered=True 时会对返回值做存储，
-                # 在进程很多且运行时间很不均衡时，可能导致内存占用量不断增多，导致OutOfMemory
                 ordered_results[_index] = _result
-
         while ordered and ordered_requirement in ordered_results:
             yield ordered_results.pop(ordered_requirement)
             ordered_requirement += 1
-
-        # TODO
-        # 怎么判断pool里所有进程都运行完了?
-        # 考虑过pool.join()，它是阻塞的不符合需求。
-        # 目前的实现有提前终止的风险，
-        # 目前的实现是：判断在pool里的processes个进程是否都结束了，如果都结束就终止，
-        # 但，如果由于其他原因导致还没执行的processes没有即使进入pool，就会误杀
         pool_finished = True
         for app in pool._pool:
             if app.exitcode != 0:
@@ -222,16 +1528,108 @@ def multi(
         if timeout and time() - begin_time > timeout:
             print('Warning: pool timeout')
             break
-
-    # TODO
-    # 不确定目前的逻辑是否会遗漏数据未返回
-    if len(ordered_results):
-        print('Warning: ordered_results 数据没有取完')
-    if not queue.empty():
-        print('Warning: queue 数据没有取完')
     pool.terminate()
 
 
+def _tiny_task() -> float:
+    # 极小的任务，返回完成时刻，用于统计结果从子进程到达消费者的延迟
+    return time()
+
+
+def _percentile(data: List[float], percent: float) -> float:
+    if not data:
+        return 0.0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(len(data) * percent))]
+
+
+def benchmark_multi(task_number: int = 10000, processes: int = cpu_count()) -> Dict[str, Dict[str, float]]:
+    """
+    对比multi（事件驱动）和_multi_polling（旧的轮询实现）处理task_number个极小任务时的吞吐量和尾延迟。
+    延迟指任务在子进程里完成到主进程拿到结果之间的时长。
+    :param task_number: 任务数量
+    :param processes: 进程数量
+    :return: {实现名: {'throughput': 每秒任务数, 'p50': 秒, 'p99': 秒, 'max': 秒, 'count': 返回的结果数}}
+    """
+    report = {}
+    for name, method in (('multi', multi), ('polling', _multi_polling)):
+        latency = []
+        begin = time()
+        for finish_time in method([_tiny_task] * task_number, processes=processes):
+            latency.append(time() - finish_time)
+        cost = time() - begin
+        report[name] = {
+            'throughput': len(latency) / cost if cost > 0 else 0.0,
+            'p50': _percentile(latency, 0.5),
+            'p99': _percentile(latency, 0.99),
+            'max': max(latency) if latency else 0.0,
+            'count': len(latency),
+        }
+        print('{:8s} count {:6d} throughput {:10.1f}/s p50 {:.4f}s p99 {:.4f}s max {:.4f}s'.format(
+            name, report[name]['count'], report[name]['throughput'],
+            report[name]['p50'], report[name]['p99'], report[name]['max']))
+    return report
+
+
+def _tiny_text_task(text: str) -> bool:
+    # 微秒级的文本操作，和is_all_chinese类似
+    for char in text:
+        if not '\u4e00' <= char <= '\u9fff':
+            return False
+    return True
+
+
+def benchmark_chunksize(
+        task_number: int = 100000,
+        chunksizes: Tuple = (1, 10, 100, 1000, 'auto'),
+        processes: int = cpu_count(),
+) -> Dict[str, Dict[Union[int, str], float]]:
+    """
+    统计multi_map、pool_starmap在不同chunksize下处理task_number个微秒级任务的吞吐量（每秒任务数）。
+    :param task_number: 任务数量
+    :param chunksizes: 待对比的chunksize
+    :param processes: 进程数量
+    :return: {方法名: {chunksize: 每秒任务数}}
+    """
+    texts = [['中文文本{}'.format(i) if i % 2 else '中文文本'] for i in range(task_number)]
+    report = {'multi_map': {}, 'pool_starmap': {}}
+    for name, method in (('multi_map', multi_map), ('pool_starmap', pool_starmap)):
+        for chunksize in chunksizes:
+            begin = time()
+            count = sum(1 for _ in method(_tiny_text_task, texts, processes=processes, chunksize=chunksize))
+            cost = time() - begin
+            report[name][chunksize] = count / cost if cost > 0 else 0.0
+            print('{:12s} chunksize {:>5} throughput {:12.1f}/s'.format(name, chunksize, report[name][chunksize]))
+    return report
+
+
+def _sleep_task(seconds: float) -> float:
+    sleep(seconds)
+    return seconds
+
+
+def benchmark_schedule(small_number: int = 60, small_cost: float = 0.02, processes: int = 4) -> Dict[str, float]:
+    """
+    对比multi_map在默认chunksize=1和设置cost（schedule调度）时处理耗时不均衡任务的总时长。
+    任务为small_number个耗时small_cost秒的小任务，末尾再跟一个耗时约为小任务总耗时/(processes-1)的大任务。
+    chunksize=1时大任务最后才被领取，总时长约为 小任务总耗时/processes + 大任务耗时；
+    设置cost后大任务最先提交，其余进程同时处理小任务，总时长约为大任务耗时。
+    :param small_number: 小任务数量
+    :param small_cost: 单个小任务的耗时（秒）
+    :param processes: 进程数量，至少为2
+    :return: {'chunksize=1': 秒, 'cost': 秒}
+    """
+    big_cost = small_number * small_cost / max(processes - 1, 1)
+    seconds = [small_cost] * small_number + [big_cost]
+    report = {}
+    for name, cost in (('chunksize=1', None), ('cost', seconds)):
+        begin = time()
+        list(multi_map(_sleep_task, seconds, processes=processes, cost=cost))
+        report[name] = time() - begin
+        print('{:12s} {:.3f}s'.format(name, report[name]))
+    return report
+
+
 def test_get_functions_base():
     print('test_get_functions_base')
 
@@ -360,6 +1758,185 @@ def test_multi_map():
         print(result)
 
 
+def test_multi_map_streaming():
+    print('test_multi_map_streaming')
+
+    def toy(x):
+        sleep(random() / 10)
+        return x
+
+    def endless():
+        x = 0
+        while True:
+            yield x
+            x += 1
+
+    for result in multi_map(toy, endless(), max_inflight=4):
+        print(result)
+        if result >= 20:
+            break
+
+
+def test_multi_reorder_buffer():
+    print('test_multi_reorder_buffer')
+
+    def toy(x):
+        sleep(1 if x == 0 else random() / 100)
+        return x
+
+    buffer = ReorderBuffer(capacity=5, spill=True)
+    print(list(multi_map(toy, range(50), max_inflight=4, reorder_buffer=buffer)))
+    print(buffer.stats())
+
+
+def test_multi_ordered_concurrency():
+    print('test_multi_ordered_concurrency')
+
+    def toy(x):
+        sleep(0.1)
+        return x
+
+    # 40个任务分为4块，max_inflight=4时4块应同时运行，约1秒而不是逐块运行的4秒
+    begin = time()
+    results = list(multi_map(toy, range(40), processes=4, ordered=True, max_inflight=4, chunksize=10))
+    cost = time() - begin
+    print(results, cost)
+    assert results == list(range(40))
+    assert cost < 3, 'ordered streaming is not concurrent: {:.2f}s'.format(cost)
+
+
+def test_multi_map_chunksize():
+    print('test_multi_map_chunksize')
+
+    def toy(x):
+        return x * 2
+
+    print(list(multi_map(toy, range(100), chunksize='auto')))
+    print(list(pool_map(toy, range(100), chunksize='auto')))
+    print(list(pool_starmap(toy, [[_] for _ in range(100)], chunksize=10)))
+
+    # 试运行在子进程里进行，initializer设置的状态在主进程里不存在
+    def init():
+        os.environ['AITOOL_TEST_OFFSET'] = '1'
+
+    def offset(x):
+        return x + int(os.environ['AITOOL_TEST_OFFSET'])
+
+    print(list(pool_map(offset, range(100), initializer=init, chunksize='auto')))
+
+
+def test_pool_executor():
+    print('test_pool_executor')
+
+    def toy(x):
+        return x, os.getpid()
+
+    with PoolExecutor(processes=2, lazy=False) as executor:
+        print(list(pool_map(toy, range(4), executor=executor)))
+        print(list(pool_starmap(toy, [[_] for _ in range(4)], executor=executor)))
+        print(list(multi_map(toy, range(4), executor=executor)))
+
+
+def test_backend():
+    print('test_backend')
+
+    def toy(x):
+        sleep(random() / 10)
+        return x
+
+    async def async_toy(x):
+        await asyncio.sleep(random() / 10)
+        return x
+
+    print(list(pool_map(toy, range(10), processes=10, backend='thread')))
+    print(list(pool_starmap(toy, [[_] for _ in range(10)], processes=10, backend='asyncio')))
+    print(list(multi_map(toy, range(10), processes=10, backend='thread')))
+    print(list(multi_map(async_toy, range(10), processes=10, backend='asyncio')))
+
+    async def consume():
+        return [result async for result in amulti_map(async_toy, range(10), processes=10)]
+    print(asyncio.run(consume()))
+
+
+def test_share():
+    print('test_share')
+    word2vec = {str(i): [random() for _ in range(300)] for i in range(10000)}
+    handle = share(word2vec)
+    print('pickled size', len(dill.dumps(word2vec)), '->', len(dill.dumps(handle)))
+
+    def toy(word, vectors=handle):
+        return sum(vectors.get()[word])
+
+    print(list(multi_map(toy, [['1'], ['2'], ['3']])))
+    handle.release()
+
+    matrix = share(np.ones((1000, 300)))
+    print(list(pool_map(lambda i, m=matrix: m.get()[i].sum(), range(3))))
+    matrix.release()
+
+
+def test_multi_task_timeout():
+    print('test_multi_task_timeout')
+
+    def toy(x):
+        sleep(x)
+        return x
+
+    for backend in ('process', 'thread', 'asyncio'):
+        print(backend, list(multi_map(toy, [0.1, 10, 0.2, 0.3], task_timeout=1, backend=backend)))
+
+    token = CancelToken()
+    for result in multi_map(toy, [0.1] * 100, cancel=token):
+        print(result)
+        if result:
+            token.cancel()
+
+
+def test_multi_map_cost():
+    print('test_multi_map_cost')
+    size = 30
+
+    def toy(row):
+        # 第row行需要计算size-row-1次，耗时呈三角形分布
+        sleep((size - row - 1) / 1000)
+        return row
+
+    begin = time()
+    print(list(multi_map(toy, range(size))), time() - begin)
+    begin = time()
+    print(list(multi_map(toy, range(size), cost=lambda row: size - row - 1)), time() - begin)
+
+
+def test_multi_retry():
+    print('test_multi_retry')
+
+    def toy(x):
+        # 偶数有一半的概率出错，重试后大概率成功；x=5总是出错
+        if x == 5:
+            raise ValueError(x)
+        if x % 2 == 0 and random() < 0.5:
+            raise RuntimeError('transient {}'.format(x))
+        return x
+
+    for result in multi_map(toy, range(8), processes=2):
+        print(result)
+    print(list(multi_map(toy, range(8), processes=2, retries=5, retry_interval=0.01)))
+    print(list(multi_map(toy, range(8), processes=2, retries=5, errors='skip')))
+    try:
+        list(multi_map(toy, range(8), processes=2, retries=5, errors='raise'))
+    except Exception as e:
+        print('raise', repr(e))
+
+    # 返回numpy数组时，按返回值是否为空判断不能抛出真值不明确的异常
+    def array_toy(x):
+        return np.arange(3) + x
+
+    for condition in ('no_error', 'no_empty'):
+        results = list(multi_map(array_toy, range(3), processes=2, retries=2, retry_condition=condition))
+        print(results)
+        assert [result.tolist() for result in results] == [[0, 1, 2], [1, 2, 3], [2, 3, 4]]
+
+
 def test_addition_1():
     print('test_addition_1')
 
@@ -383,6 +1960,16 @@ if __name__ == '__main__':
     test_pool_starmap()
     test_pool_starmap_2()
     test_multi_map()
+    test_multi_map_streaming()
+    test_multi_reorder_buffer()
+    test_multi_ordered_concurrency()
+    test_multi_map_chunksize()
+    test_pool_executor()
+    test_backend()
+    test_share()
+    test_multi_task_timeout()
+    test_multi_map_cost()
+    test_multi_retry()
 
     # 其他次要的测试样例
     test_multi_base()
@@ -393,3 +1980,7 @@ if __name__ == '__main__':
 
     # 附加测试样例
     test_addition_1()
+
+    # 性能对比
+    benchmark_multi()
+    benchmark_chunksize()
@@ -15,24 +15,77 @@
 """
 
 """
-from typing import Dict, Union, List, Any, NoReturn
+from typing import Dict, Union, List, Any, NoReturn, Tuple
 from functools import wraps
 from time import sleep
 import logging
 
 
-def retry(
+def check_retry_args(
         max_retry_time: int = 3,
         interval: float = 0,
         condition: str = 'no_error',
-        callback: Any = None,
-):
+) -> Tuple[int, float, str]:
+    """
+    校正retry的参数，不合法的值会被替换为默认值
+    >>> check_retry_args(-1, -1, 'unknown')
+    (0, 0, 'no_error')
+    """
     if max_retry_time < 0:
         max_retry_time = 0
     if interval < 0:
         interval = 0
     if condition not in ['no_error', 'no_empty']:
         condition = 'no_error'
+    return max_retry_time, interval, condition
+
+
+def is_empty(result: Any) -> bool:
+    """
+    判断返回值是否为空。有长度的按长度判断，否则按真值判断；
+    numpy数组、DataFrame等真值不明确的对象视为非空，不会抛出异常
+    >>> is_empty([]), is_empty(None), is_empty(0), is_empty('a')
+    (True, True, True, False)
+    >>> import numpy as np
+    >>> is_empty(np.arange(3)), is_empty(np.arange(0))
+    (False, True)
+    """
+    try:
+        return len(result) == 0
+    except Exception:
+        pass
+    try:
+        return not result
+    except Exception:
+        return False
+
+
+def need_retry(condition: str, catch_exception: bool, result_empty: bool) -> bool:
+    """
+    依据一次运行的情况判断是否需要重试
+    :param condition: 'no_error'表示出错时重试，'no_empty'表示返回值为空时重试
+    :param catch_exception: 是否抛出了异常
+    :param result_empty: 返回值是否为空
+    :return: 是否需要重试
+    >>> need_retry('no_error', True, False)
+    True
+    >>> need_retry('no_empty', False, True)
+    True
+    """
+    if condition == 'no_error' and not catch_exception:
+        return False
+    if condition == 'no_empty' and not result_empty:
+        return False
+    return True
+
+
+def retry(
+        max_retry_time: int = 3,
+        interval: float = 0,
+        condition: str = 'no_error',
+        callback: Any = None,
+):
+    max_retry_time, interval, condition = check_retry_args(max_retry_time, interval, condition)
 
     def retry_func(func):
         @wraps(func)
@@ -48,14 +101,12 @@ def retry(
                 result_empty = False
                 try:
                     result = func(*args, **kwargs)
-                    if not result:
-                        result_empty = True
+                    if condition == 'no_empty':
+                        result_empty = is_empty(result)
                 except Exception as e:
                     logging.warning(e)
                     catch_exception = True
-                if condition == 'no_error' and not catch_exception:
-                    break
-                if condition == 'no_empty' and not result_empty:
+                if not need_retry(condition, catch_exception, result_empty):
                     break
 
                 sleep(interval)
@@ -18,7 +18,7 @@
 from collections import defaultdict
 from typing import Dict, Union, List, Any, NoReturn, Tuple, Callable
 from aitool import DATAPATH, load_line, load_pickle, is_all_chinese, dump_pickle, get_ngram, get_aitool_data_path, \
-    dump_lines, pool_map, exe_time, singleton
+    dump_lines, pool_map, exe_time, singleton, NearDuplication
 from tqdm import tqdm
 from numpy import dot
 from numpy.linalg import norm
@@ -150,28 +150,38 @@ def de_sim(
         method: Callable = char_sim,
         threshold: float = 0.8,
         show: bool = False,
+        index: str = None,
+        ngram: int = 1,
 ) -> Tuple[List[str], Dict[str, str]]:
     """
     输入一组有顺序的文本，从前往后，仅保留和前面文本相似度低于阈值的文本。
-    TODO 单纯的for循环太慢
+    默认只和有相同字的文本比较，常用字很多时接近两两比较。文本很多时用index='minhash'，
+    只和LSH分到同一个桶的文本比较，会漏掉少量相似度刚过阈值的文本。
     :param ordered_texts: 一组有顺序的文本
     :param method: 相似度方法，输出阈值[0,1]
     :param threshold: 大于等于该阈值被视为相似
     :param show: 打印信息
+    :param index: None用逐字的倒排表找候选，'minhash'或'simhash'用NearDuplication找候选
+    :param ngram: index不为None时，NearDuplication取字的ngram作为特征。ngram=1时minhash估计的就是char_sim
     :return: (保留下来的一组文本List[str]，删除详情{被删除的文本:高相似的保留的文本})
     """
     selected = []
     char2text = defaultdict(list)
+    near = None if index is None else NearDuplication(threshold=threshold, method=index, ngram=ngram)
     detail = {}
     count = 0
     for text in tqdm(ordered_texts, 'de_sim'):
-        # 仅对有重复字的做相似度比较，提高速度
-        candidate = []
-        for char in text:
-            candidate.extend(char2text[char])
-        for char in set(text):
-            char2text[char].append(text)
-        candidate = set(candidate)
+        if near is not None:
+            candidate = set(near.candidates(text))
+            near.insert(text)
+        else:
+            # 仅对有重复字的做相似度比较，提高速度
+            candidate = []
+            for char in text:
+                candidate.extend(char2text[char])
+            for char in set(text):
+                char2text[char].append(text)
+            candidate = set(candidate)
         match = False
         for st in candidate:
             count += 1
@@ -336,6 +346,8 @@ if __name__ == '__main__':
     ]
     print('char_sim')
     _, de = de_sim(nodes, method=char_sim, threshold=0.8, show=True)
+    print('char_sim minhash')
+    _, de = de_sim(nodes, method=char_sim, threshold=0.8, show=True, index='minhash')
     vs = VectorSim()
     print('vs.sim')
     _, de = de_sim(nodes, method=vs.sim, threshold=0.8, show=True)
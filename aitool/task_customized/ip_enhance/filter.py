@@ -16,10 +16,12 @@
 
 """
 import os
+import pickle
 import warnings
 import logging
 import re
-from typing import Dict, Union, List, Any, NoReturn
+from functools import lru_cache
+from typing import Dict, Union, List, NoReturn, Iterable, Tuple
 from aitool.datasets import PATH as DATA_PATH
 from aitool.basic_function.file import is_file_exist, load_lines, load_json
 from aitool.basic_function.download.download import prepare_data
@@ -31,7 +33,7 @@ File_Chinese_Family_Name = os.path.join(DATA_PATH, 'nlp', 'words', 'Names', 'Chi
 
 
 def has_family_name(name: str) -> bool:
-    if not chinese_family_name:
+    if not chinese_family_name and not load_word_snapshot(names=('chinese_family_name',)):
         if not is_file_exist(File_Chinese_Family_Name):
             prepare_data(*File_Bag, packed=True)
         for item in load_lines(File_Chinese_Family_Name):
@@ -46,6 +48,8 @@ DIR_THUOCL = os.path.join(DATA_PATH, 'nlp', 'words', 'THUOCL')
 FILE_XINHUA_CI = os.path.join(DATA_PATH, 'nlp', 'words', 'XINHUA', 'ci.json')
 
 def init_word_common(threshold: int = 10) -> NoReturn:
+    if threshold == SNAPSHOT_THRESHOLD and load_word_snapshot(names=('word_common',)):
+        return
     if not is_file_exist(DIR_THUOCL) or not is_file_exist(FILE_XINHUA_CI):
         prepare_data(*File_Bag, packed=True)
     files = os.listdir(DIR_THUOCL)
@@ -53,7 +57,7 @@ def init_word_common(threshold: int = 10) -> NoReturn:
         with open(os.path.join(DIR_THUOCL, file), 'r') as fin:
             for line in fin:
                 w, f = line.strip().split('\t')
-                if eval(f) > threshold:
+                if float(f) > threshold:
                     word_common.add(w)
     data = load_json(FILE_XINHUA_CI)
     for line in data:
@@ -73,6 +77,8 @@ FILE_STOPWORDS = os.path.join(DATA_PATH, 'nlp', 'words', 'stopwords.txt')
 
 
 def init_word_stop() -> NoReturn:
+    if load_word_snapshot(names=('word_stop',)):
+        return
     with open(FILE_STOPWORDS, 'r') as fin:
         for line in fin:
             word = line.strip()
@@ -92,6 +98,8 @@ FILE_RELATIONSHIP = os.path.join(DATA_PATH, 'nlp', 'words', 'Names', 'relationsh
 
 
 def init_relationship_title() -> NoReturn:
+    if load_word_snapshot(names=('relationship_title',)):
+        return
     if not is_file_exist(FILE_RELATIONSHIP):
         prepare_data(*File_Bag, packed=True)
     relationship_title_addition = {'店长', '法师', '醫生', '大力士', '护士', '父亲', '天后', '教练', '保安', '计师', '管事',
@@ -117,6 +125,102 @@ def is_relationship_title(text: str) -> bool:
     return False
 
 
+FILE_WORD_SNAPSHOT = os.path.join(DATA_PATH, 'nlp', 'words', 'filter_snapshot.pkl')
+# 快照里的word_common对应的init_word_common的threshold
+SNAPSHOT_THRESHOLD = 10
+# 快照里的各个词表
+SNAPSHOT_WORDS = ('chinese_family_name', 'word_common', 'word_stop', 'relationship_title')
+# 'unloaded'、'loaded'，或'disabled'表示快照过期或正在构建快照，此时从文本词表构建
+_snapshot_state = 'unloaded'
+# 已读取的快照，各个词表第一次使用时才从中加载
+_snapshot = {}
+# 已从快照加载的词表
+_snapshot_loaded = set()
+
+
+def _snapshot_sources() -> Dict[str, float]:
+    # 生成各个词表的源文件及其修改时间，用于判断快照是否过期
+    paths = [File_Chinese_Family_Name, FILE_XINHUA_CI, FILE_STOPWORDS, FILE_RELATIONSHIP]
+    if os.path.isdir(DIR_THUOCL):
+        paths += [os.path.join(DIR_THUOCL, file) for file in sorted(os.listdir(DIR_THUOCL))]
+    return {path: os.path.getmtime(path) for path in paths if os.path.exists(path)}
+
+
+def build_word_snapshot(path: str = FILE_WORD_SNAPSHOT) -> NoReturn:
+    """
+    从文本词表构建chinese_family_name、word_common、word_stop和relationship_title，
+    并以frozenset的形式pickle到path，之后各个进程第一次使用时直接加载快照，无需重新解析文本
+    :param path: 快照的路径
+    """
+    global _snapshot_state, _snapshot
+    _snapshot_state = 'disabled'
+    _snapshot_loaded.clear()
+    for words in (chinese_family_name, word_common, word_stop, relationship_title):
+        words.clear()
+    has_family_name('')
+    init_word_common(SNAPSHOT_THRESHOLD)
+    init_word_stop()
+    init_relationship_title()
+    snapshot = {
+        'sources': _snapshot_sources(),
+        'threshold': SNAPSHOT_THRESHOLD,
+        'chinese_family_name': frozenset(chinese_family_name),
+        'word_common': frozenset(word_common),
+        'word_stop': frozenset(word_stop),
+        'relationship_title': {length: frozenset(items) for length, items in relationship_title.items()},
+    }
+    # 先写临时文件再替换，避免其他进程读到写了一半的快照
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'wb') as fout:
+        pickle.dump(snapshot, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+    _snapshot = snapshot
+    _snapshot_loaded.update(SNAPSHOT_WORDS)
+    _snapshot_state = 'loaded'
+
+
+def load_word_snapshot(path: str = FILE_WORD_SNAPSHOT, names: Iterable[str] = SNAPSHOT_WORDS) -> bool:
+    """
+    加载build_word_snapshot生成的快照。每个进程只读取一次，源文件被修改过时不加载。
+    只加载names里的词表，每个词表只加载一次；已经从文本词表构建过的词表不会再合并快照，
+    word_common只有在快照是按SNAPSHOT_THRESHOLD构建时才加载。
+    在创建进程池之前调用，fork出的子进程可以直接使用已加载的词表
+    :param path: 快照的路径
+    :param names: 要加载的词表，默认是SNAPSHOT_WORDS里的全部词表
+    :return: names里的词表是否都已从快照加载
+    """
+    global _snapshot_state, _snapshot
+    if _snapshot_state == 'unloaded':
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as fin:
+            snapshot = pickle.load(fin)
+        if snapshot['sources'] != _snapshot_sources():
+            print('Warning: word snapshot is out of date, rebuild it by build_word_snapshot()', path)
+            _snapshot_state = 'disabled'
+            return False
+        _snapshot = snapshot
+        _snapshot_state = 'loaded'
+    if _snapshot_state != 'loaded':
+        return False
+    loaded = True
+    for name in names:
+        if name in _snapshot_loaded:
+            continue
+        words = globals()[name]
+        if words or (name == 'word_common' and _snapshot.get('threshold') != SNAPSHOT_THRESHOLD):
+            loaded = False
+            continue
+        # 各个词表是模块级的对象，可能已被其他模块引用，所以原地更新而不是重新赋值
+        if name == 'relationship_title':
+            for length, items in _snapshot[name].items():
+                words.setdefault(length, set()).update(items)
+        else:
+            words.update(_snapshot[name])
+        _snapshot_loaded.add(name)
+    return loaded
+
+
 def is_contains_english(text: str) -> bool:
     for c in text:
         _ord = ord(c)
@@ -257,6 +361,125 @@ def clean_alias(text: str) -> (str, int):
     logging.info('{}, {}'.format(text, score))
     return text, score
 
+
+class RoleClassifier:
+    """
+    clean_role和clean_alias的批量版本，结果和二者一致。
+    各个词表只在初始化时合并一次；预处理用str.translate和正则完成；
+    是否含英文、数字、是否全为中文在一次遍历字符的过程中判断；
+    同一个输入的结果记录在容量为cache_size的LRU里，重复出现的名字不会重复计算。
+    clean_role(text)和clean_alias(text)分别对应同名的函数。
+    """
+    def __init__(self, cache_size: int = 1000000):
+        """
+        :param cache_size: 记录的不同输入的数量上限
+        """
+        if not chinese_family_name:
+            has_family_name('')
+        if not word_common:
+            init_word_common()
+        if not relationship_title:
+            init_relationship_title()
+        self.family_name = frozenset(chinese_family_name)
+        self.word_common = frozenset(word_common)
+        # is_relationship_title要求称谓比text少一个字，text[:-1]和text[1:]的长度正好满足，因此可以合并为一个集合
+        self.relationship_title = frozenset().union(*relationship_title.values())
+        self.black_name = frozenset(black_name)
+        # 每次调用都要查询，所以用C实现的lru_cache而不是Cache
+        self.clean_role = lru_cache(maxsize=cache_size)(self._clean_role)
+        self.clean_alias = lru_cache(maxsize=cache_size)(self._clean_alias)
+
+    def _scan(self, text: str) -> (int, bool):
+        # 返回(clean_role和clean_alias共有的扣分, 是否全为中文)
+        if _all_chinese_pattern.fullmatch(text):
+            # 大部分名字全是中文，不需要再判断英文和数字
+            all_chinese = True
+            penalty = 0
+        else:
+            english = False
+            figure = False
+            for char in text:
+                if '\u4e00' <= char <= '\u9fff':
+                    continue
+                if char.isdigit():
+                    figure = True
+                elif 'A' <= char <= 'Z' or 'a' <= char <= 'z':
+                    english = True
+            all_chinese = False
+            penalty = english + figure
+        if text[:-1] in self.relationship_title or text[1:] in self.relationship_title:
+            penalty += 1
+        if is_nick_name(text):
+            penalty += 1
+        return penalty, all_chinese
+
+    def _clean_role(self, text: str) -> (str, int):
+        match = _cut_until_char_pattern.search(text)
+        if match:
+            text = text[:match.start()]
+        text = delete_age_describe(text.translate(_delete_char_table))
+        if not text:
+            return '', -100
+        penalty, all_chinese = self._scan(text)
+        score = 10 - penalty + all_chinese
+        if text[0] in self.family_name:
+            score -= 1
+        if text in self.word_common:
+            score -= 1
+        if text in self.black_name:
+            score -= 1
+        return text, score
+
+    def _clean_alias(self, text: str) -> (str, int):
+        if not text:
+            return '', -100
+        penalty, all_chinese = self._scan(text)
+        score = 13 - penalty + all_chinese
+        if text in self.word_common:
+            score -= 5
+        # 称谓在clean_alias里扣3分，_scan里已扣1分
+        if text[:-1] in self.relationship_title or text[1:] in self.relationship_title:
+            score -= 2
+        return text, score
+
+    def clean_roles(self, texts: Iterable[str]) -> List[Tuple[str, int]]:
+        return list(map(self.clean_role, texts))
+
+    def clean_aliases(self, texts: Iterable[str]) -> List[Tuple[str, int]]:
+        return list(map(self.clean_alias, texts))
+
+
+_cut_until_char_pattern = re.compile('[{}]'.format(re.escape(''.join(cut_until_char_delimiter))))
+_delete_char_table = {ord(char): None for char in delete_char_discard}
+_all_chinese_pattern = re.compile('[\u4e00-\u9fff]*')
+_role_classifier = None
+
+
+def get_role_classifier() -> RoleClassifier:
+    global _role_classifier
+    if _role_classifier is None:
+        _role_classifier = RoleClassifier()
+    return _role_classifier
+
+
+def clean_roles(texts: Iterable[str]) -> List[Tuple[str, int]]:
+    """
+    批量运行clean_role，结果和逐个调用clean_role一致，适用于上千万量级的角色名
+    :param texts: 角色名的列表
+    :return: 各个角色名的(清洗后的文本, 分数)
+    """
+    return get_role_classifier().clean_roles(texts)
+
+
+def clean_aliases(texts: Iterable[str]) -> List[Tuple[str, int]]:
+    """
+    批量运行clean_alias，结果和逐个调用clean_alias一致
+    :param texts: 别名的列表
+    :return: 各个别名的(文本, 分数)
+    """
+    return get_role_classifier().clean_aliases(texts)
+
+
 import sys
 from unicodedata import category
 punctuation_chars = set([chr(i) for i in range(sys.maxunicode)
@@ -342,6 +565,7 @@ if __name__ == '__main__':
     print(clean_role('汽车'))
     print(clean_role('唐三'))
     print(clean_role('唐三(主角)'))
+    print(clean_roles(['汽车', '唐三', '唐三(主角)', '唐三']))
     print(get_core_ip('托马斯和他的朋友们第十九部分'))
     print(get_core_ip('托马斯和他的朋友们19'))
     print(get_core_ip('托马斯和他的朋友们结局一'))